@@ -0,0 +1,92 @@
+import asyncio
+from collections import Counter
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from aiohttp import ClientError, ClientSession
+
+RequestFactory = Callable[[ClientSession, int], Awaitable[int]]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index: int = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Scenario:
+    def __init__(
+        self,
+        name: str,
+        request: RequestFactory,
+        expected: Set[int],
+        requests: Optional[int] = None,
+    ) -> None:
+        self.name: str = name
+        self.request: RequestFactory = request
+        self.expected: Set[int] = expected
+        self.requests: Optional[int] = requests
+
+
+async def run_scenario(
+    session: ClientSession,
+    scenario: Scenario,
+    requests: int,
+    concurrency: int,
+    warmup: int = 0,
+    duration: Optional[float] = None,
+) -> Dict[str, Any]:
+    total: int = requests
+    if scenario.requests is not None:
+        total, warmup = scenario.requests, 0
+    for i in range(warmup):
+        await scenario.request(session, total + i)
+
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    errors: int = 0
+    issued: int = 0
+    started: float = perf_counter()
+    deadline: Optional[float] = started + duration if duration else None
+
+    async def worker() -> None:
+        nonlocal issued, errors
+        while issued < total and (deadline is None or perf_counter() < deadline):
+            index: int = issued
+            issued += 1
+            request_started: float = perf_counter()
+            try:
+                status: int = await scenario.request(session, index)
+            except (asyncio.TimeoutError, ClientError):
+                errors += 1
+                statuses["error"] += 1
+                continue
+            latencies.append(perf_counter() - request_started)
+            statuses[str(status)] += 1
+            if status not in scenario.expected:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed: float = perf_counter() - started
+
+    latencies.sort()
+    completed: int = len(latencies)
+    return {
+        "name": scenario.name,
+        "requests": issued,
+        "completed": completed,
+        "errors": errors,
+        "status_codes": dict(statuses),
+        "duration_s": round(elapsed, 3),
+        "rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "min": round(latencies[0] * 1000, 3) if latencies else 0.0,
+            "mean": round(sum(latencies) / completed * 1000, 3) if latencies else 0.0,
+            **{
+                name: round(percentile(latencies, q) * 1000, 3)
+                for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+            },
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+    }
@@ -0,0 +1,56 @@
+import argparse
+import asyncio
+from ipaddress import ip_address
+from typing import Dict
+
+from aiohttp import web
+
+COUNTRIES = ["Germany", "United States", "France", "Japan", "Brazil", "India"]
+
+
+def fake_ip_data(ip: str) -> Dict[str, dict]:
+    value: int = int(ip_address(ip))
+    return {
+        "network": {"provider": f"Stub Networks {value % 16}"},
+        "location": {
+            "country_name": COUNTRIES[value % len(COUNTRIES)],
+            "region_name": "Stub Region",
+            "city_name": "Stub City",
+            "latitude": "50.1109",
+            "longitude": "8.6821",
+            "timezone": "Europe/Berlin",
+        },
+        "detections": {"proxy": value % 10 == 0, "hosting": False},
+    }
+
+
+def create_app(latency: float) -> web.Application:
+    async def lookup(request: web.Request) -> web.Response:
+        form = await request.post()
+        ips = [ip for ip in str(form.get("ips", "")).split(",") if ip]
+        if latency:
+            await asyncio.sleep(latency)
+        body: Dict[str, object] = {"status": "ok"}
+        body.update((ip, fake_ip_data(ip)) for ip in ips)
+        return web.json_response(body)
+
+    app = web.Application()
+    app.router.add_post("/{tail:.*}", lookup)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stub proxycheck.io v3 server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds added per request"
+    )
+    args = parser.parse_args()
+    web.run_app(
+        create_app(args.latency), host=args.host, port=args.port, print=None
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from ipaddress import IPv4Address
+from pathlib import Path
+from random import randrange
+from time import monotonic
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from asyncpg import create_pool
+
+from benchmarks.load import RequestFactory, Scenario, run_scenario
+from benchmarks.seed import CLICK_VOLUMES, SEED_IP_BASE, seed
+from config import DATABASE_URL
+
+logger = logging.getLogger("benchmarks")
+
+ROOT: Path = Path(__file__).resolve().parents[1]
+WARM_IP: str = str(IPv4Address(SEED_IP_BASE) + 1)
+STATS_ENDPOINTS: List[str] = [
+    "browsers",
+    "os",
+    "devices",
+    "countries",
+    "guests",
+    "summary",
+]
+
+
+async def send(session: ClientSession, method: str, url: str, **kwargs: Any) -> int:
+    async with session.request(method, url, allow_redirects=False, **kwargs) as resp:
+        await resp.read()
+        return resp.status
+
+
+def request(method: str, url: str, **kwargs: Any) -> RequestFactory:
+    async def factory(session: ClientSession, index: int) -> int:
+        return await send(session, method, url, **kwargs)
+
+    return factory
+
+
+def build_scenarios(
+    base_url: str, fixture: Dict[str, Any], created: List[str], export_limit: int
+) -> List[Scenario]:
+    codes: Dict[str, str] = fixture["codes"]
+    headers: Dict[str, str] = fixture["headers"]
+    warm: Dict[str, str] = {"X-Forwarded-For": WARM_IP}
+    cold_base: int = int(IPv4Address("10.0.0.0")) + randrange(1 << 23)
+
+    async def redirect_cold(session: ClientSession, index: int) -> int:
+        ip: str = str(IPv4Address(cold_base + index))
+        return await send(
+            session,
+            "GET",
+            f"{base_url}/{codes['plain']}",
+            headers={"X-Forwarded-For": ip},
+        )
+
+    async def url_create(session: ClientSession, index: int) -> int:
+        async with session.post(
+            f"{base_url}/api/url/",
+            json={
+                "original_url": (
+                    f"https://example.com/bench/{fixture['run_id']}/created-{index}"
+                )
+            },
+            headers=headers,
+        ) as resp:
+            body: dict = await resp.json(content_type=None)
+            if resp.status == 200:
+                created.append(body["short_code"])
+            return resp.status
+
+    async def url_update(session: ClientSession, index: int) -> int:
+        return await send(
+            session,
+            "PATCH",
+            f"{base_url}/api/url/{codes['crud']}",
+            json={"allow_proxy": index % 2 == 0},
+            headers=headers,
+        )
+
+    async def url_delete(session: ClientSession, index: int) -> int:
+        return await send(
+            session, "DELETE", f"{base_url}/api/url/{created[index]}", headers=headers
+        )
+
+    stats_params: Dict[str, str] = {"short_code": codes["stats"]}
+    scenarios: List[Scenario] = [
+        Scenario(
+            "redirect_warm_ip",
+            request("GET", f"{base_url}/{codes['plain']}", headers=warm),
+            {307},
+        ),
+        Scenario("redirect_cold_ip", redirect_cold, {307}),
+        Scenario(
+            "redirect_password",
+            request(
+                "GET",
+                f"{base_url}/{codes['password']}",
+                params={"password": "secret"},
+                headers=warm,
+            ),
+            {307},
+        ),
+        Scenario(
+            "redirect_expired",
+            request("GET", f"{base_url}/{codes['expired']}", headers=warm),
+            {410},
+        ),
+        Scenario("url_create", url_create, {200}),
+        Scenario(
+            "url_get",
+            request("GET", f"{base_url}/api/url/{codes['crud']}", headers=headers),
+            {200},
+        ),
+        Scenario("url_update", url_update, {200}),
+        Scenario(
+            "url_list",
+            request(
+                "GET", f"{base_url}/api/url/", params={"limit": 100}, headers=headers
+            ),
+            {200},
+        ),
+        Scenario("url_delete", url_delete, {200}, requests=0),
+    ]
+    scenarios.extend(
+        Scenario(
+            f"stats_{endpoint}",
+            request(
+                "GET",
+                f"{base_url}/api/stats/{endpoint}",
+                params=stats_params,
+                headers=headers,
+            ),
+            {200},
+        )
+        for endpoint in STATS_ENDPOINTS
+    )
+    scenarios.append(
+        Scenario(
+            "stats_timeseries",
+            request(
+                "GET",
+                f"{base_url}/api/stats/timeseries",
+                params={
+                    **stats_params,
+                    "from": (datetime.utcnow() - timedelta(days=7)).isoformat(),
+                    "bucket": "hour",
+                },
+                headers=headers,
+            ),
+            {200},
+        )
+    )
+    scenarios.append(
+        Scenario(
+            "stats_export",
+            request(
+                "GET",
+                f"{base_url}/api/stats/export",
+                params={**stats_params, "format": "csv", "limit": export_limit},
+                headers=headers,
+            ),
+            {200},
+        )
+    )
+    return scenarios
+
+
+async def spawn(*args: str, env: Optional[Dict[str, str]] = None):
+    return await asyncio.create_subprocess_exec(
+        sys.executable, *args, cwd=ROOT, env={**os.environ, **(env or {})}
+    )
+
+
+async def wait_ready(session: ClientSession, url: str, timeout: float) -> None:
+    deadline: float = monotonic() + timeout
+    while True:
+        try:
+            async with session.get(url) as resp:
+                if resp.status < 500:
+                    return
+        except (asyncio.TimeoutError, ClientError):
+            pass
+        if monotonic() > deadline:
+            raise RuntimeError(f"{url} did not become ready in {timeout}s")
+        await asyncio.sleep(0.2)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    started_at: str = datetime.utcnow().isoformat()
+    processes: list = []
+    base_url: str = args.base_url or f"http://127.0.0.1:{args.app_port}"
+    connector: TCPConnector = TCPConnector(limit=args.concurrency)
+    async with ClientSession(
+        connector=connector, timeout=ClientTimeout(total=args.timeout)
+    ) as session:
+        try:
+            if not args.base_url:
+                processes.append(
+                    await spawn(
+                        "-m",
+                        "benchmarks.proxycheck_stub",
+                        "--port",
+                        str(args.stub_port),
+                        "--latency",
+                        str(args.stub_latency),
+                    )
+                )
+                processes.append(
+                    await spawn(
+                        "-m",
+                        "uvicorn",
+                        "main:app",
+                        "--host",
+                        "127.0.0.1",
+                        "--port",
+                        str(args.app_port),
+                        "--workers",
+                        str(args.workers),
+                        "--proxy-headers",
+                        "--forwarded-allow-ips",
+                        "*",
+                        "--log-level",
+                        "warning",
+                        "--no-access-log",
+                        env={"PROXYCHECK_URL": f"http://127.0.0.1:{args.stub_port}/"},
+                    )
+                )
+            await wait_ready(session, f"{base_url}/openapi.json", args.startup_timeout)
+
+            clicks: int = CLICK_VOLUMES[args.clicks]
+            pool = await create_pool(DATABASE_URL, min_size=1, max_size=2)
+            try:
+                logger.info("Seeding %d clicks", clicks)
+                fixture: Dict[str, Any] = await seed(session, pool, base_url, clicks)
+            finally:
+                await pool.close()
+
+            created: List[str] = []
+            selected: List[str] = [name for name in args.scenarios.split(",") if name]
+            results: List[Dict[str, Any]] = []
+            for scenario in build_scenarios(
+                base_url, fixture, created, args.export_limit
+            ):
+                if selected and not any(
+                    scenario.name.startswith(name) for name in selected
+                ):
+                    continue
+                if scenario.name == "url_delete":
+                    scenario.requests = len(created)
+                logger.info("Running %s", scenario.name)
+                results.append(
+                    await run_scenario(
+                        session,
+                        scenario,
+                        args.requests,
+                        args.concurrency,
+                        args.warmup,
+                        args.duration,
+                    )
+                )
+        finally:
+            for process in processes:
+                process.terminate()
+            await asyncio.gather(*(process.wait() for process in processes))
+
+    return {
+        "meta": {
+            "started_at": started_at,
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "clicks": clicks,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "workers": args.workers,
+            "stub_latency_s": args.stub_latency,
+        },
+        "scenarios": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the redirect, URL and stats endpoints"
+    )
+    parser.add_argument("--clicks", choices=list(CLICK_VOLUMES), default="10k")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--duration", type=float, help="per-scenario time cap in s")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--export-limit", type=int, default=10000)
+    parser.add_argument(
+        "--scenarios", default="", help="comma-separated scenario name prefixes"
+    )
+    parser.add_argument("--base-url", help="benchmark an already running server")
+    parser.add_argument("--app-port", type=int, default=8098)
+    parser.add_argument("--stub-port", type=int, default=8099)
+    parser.add_argument("--stub-latency", type=float, default=0.02)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="write the JSON report here, not stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    report: Dict[str, Any] = asyncio.run(benchmark(args))
+    body: str = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(body + "\n")
+    else:
+        print(body)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List
+from uuid import uuid4
+
+from aiohttp import ClientSession
+from asyncpg import Pool
+
+from repositories.click_repository import ClickRepository
+
+logger = logging.getLogger(__name__)
+
+CLICK_VOLUMES: Dict[str, int] = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+SEED_IP_COUNT: int = 5000
+SEED_IP_BASE: str = "172.16.0.0"
+CLICK_CHUNK: int = 1_000_000
+FILLER_URLS: int = 1000
+
+INSERT_IPS: str = """
+    INSERT INTO ip_addresses (ip_address, country, provider, timezone, is_proxy)
+    SELECT
+        $1::inet + g,
+        (ARRAY['Germany', 'United States', 'France', 'Japan', 'Brazil', 'India'])
+            [1 + g % 6],
+        'Seed Networks',
+        'Europe/Berlin',
+        g % 10 = 0
+    FROM generate_series(1, $2) g
+    ON CONFLICT (ip_address) DO NOTHING
+"""
+
+INSERT_CLICKS: str = """
+    INSERT INTO clicks (url_id, clicked_at, browser, device, os, ip)
+    SELECT
+        $1,
+        $2::timestamp - random() * INTERVAL '30 days',
+        (ARRAY['Chrome', 'Firefox', 'Safari', 'Edge', 'Opera'])[1 + g % 5],
+        (ARRAY['computer', 'phone', 'tablet'])[1 + g % 3],
+        (ARRAY['Windows', 'Mac OS X', 'Android', 'iOS'])[1 + g % 4],
+        ($3::int[])[1 + g % cardinality($3::int[])]
+    FROM generate_series($4::int, $5::int) g
+"""
+
+async def _create_url(
+    session: ClientSession, base_url: str, headers: dict, payload: dict
+) -> str:
+    async with session.post(
+        f"{base_url}/api/url/", json=payload, headers=headers
+    ) as resp:
+        resp.raise_for_status()
+        return (await resp.json())["short_code"]
+
+
+async def seed_clicks(pool: Pool, url_id: int, clicks: int) -> None:
+    async with pool.acquire() as conn:
+        await conn.execute(INSERT_IPS, SEED_IP_BASE, SEED_IP_COUNT)
+        ip_ids: List[int] = await conn.fetchval(
+            """
+            SELECT array_agg(id) FROM ip_addresses
+            WHERE ip_address > $1::inet AND ip_address <= $1::inet + $2
+            """,
+            SEED_IP_BASE,
+            SEED_IP_COUNT,
+        )
+        now: datetime = datetime.utcnow()
+        for start in range(1, clicks + 1, CLICK_CHUNK):
+            end: int = min(start + CLICK_CHUNK - 1, clicks)
+            await conn.execute(INSERT_CLICKS, url_id, now, ip_ids, start, end)
+            logger.info("Seeded %d/%d clicks", end, clicks)
+        await conn.execute(
+            """
+            UPDATE urls SET
+                click_count = (SELECT COUNT(*) FROM clicks WHERE url_id = $1),
+                last_clicked_at = (SELECT MAX(clicked_at) FROM clicks WHERE url_id = $1)
+            WHERE id = $1
+            """,
+            url_id,
+        )
+        await conn.execute("ANALYZE clicks")
+
+    await ClickRepository(pool).rebuild_rollups(url_id)
+
+
+async def seed(
+    session: ClientSession, pool: Pool, base_url: str, clicks: int
+) -> Dict[str, object]:
+    run_id: str = uuid4().hex[:12]
+    credentials: dict = {
+        "email": f"bench-{run_id}@example.com",
+        "password": "benchmark",
+    }
+    async with session.post(
+        f"{base_url}/api/auth/register", json={"name": "bench", **credentials}
+    ) as resp:
+        resp.raise_for_status()
+    async with session.post(
+        f"{base_url}/api/auth/akey-generate", json=credentials
+    ) as resp:
+        resp.raise_for_status()
+        api_key: str = (await resp.json())["api_key"]
+    headers: dict = {"Authorization": f"Bearer {api_key}"}
+
+    def target(name: str) -> str:
+        return f"https://example.com/bench/{run_id}/{name}"
+
+    codes: Dict[str, str] = {}
+    for name in ("plain", "crud", "stats", "expired"):
+        codes[name] = await _create_url(
+            session, base_url, headers, {"original_url": target(name)}
+        )
+    codes["password"] = await _create_url(
+        session,
+        base_url,
+        headers,
+        {"original_url": target("password"), "password": "secret"},
+    )
+    fillers: List[dict] = [
+        {"original_url": target(f"filler-{i}")} for i in range(FILLER_URLS)
+    ]
+    async with session.post(
+        f"{base_url}/api/url/bulk", json={"urls": fillers}, headers=headers
+    ) as resp:
+        resp.raise_for_status()
+
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE urls SET expires_at = $2 WHERE short_code = $1",
+            codes["expired"],
+            datetime.utcnow() - timedelta(days=1),
+        )
+        url_id: int = await conn.fetchval(
+            "SELECT id FROM urls WHERE short_code = $1", codes["stats"]
+        )
+    await seed_clicks(pool, url_id, clicks)
+
+    return {"run_id": run_id, "headers": headers, "codes": codes}
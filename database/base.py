@@ -1,12 +1,220 @@
-from asyncpg import Pool, create_pool
+import asyncio
+import logging
+from time import monotonic, perf_counter
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from asyncpg import (
+    Connection,
+    InterfaceError,
+    Pool,
+    PostgresConnectionError,
+    create_pool,
+)
 from fastapi import FastAPI
 
 from config import DATABASE_URL
+from database.statements import PreparedConnection, prepare_statements
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ERRORS: tuple = (
+    OSError,
+    asyncio.TimeoutError,
+    PostgresConnectionError,
+    InterfaceError,
+)
+
+T = TypeVar("T")
+
+
+class PoolAcquireContext:
+    def __init__(self, pool: "MonitoredPool", timeout: Optional[float]) -> None:
+        self.pool: MonitoredPool = pool
+        self.timeout: Optional[float] = timeout
+        self.conn: Optional[Connection] = None
+
+    async def __aenter__(self) -> Connection:
+        self.pool.waiting += 1
+        started: float = perf_counter()
+        try:
+            self.conn = await self.pool.raw.acquire(timeout=self.timeout)
+        finally:
+            self.pool.waiting -= 1
+            self.pool.record_wait(perf_counter() - started)
+        return self.conn
+
+    async def __aexit__(self, *exc: Any) -> None:
+        conn, self.conn = self.conn, None
+        await self.pool.raw.release(conn)
+
+
+class MonitoredPool:
+    def __init__(self, pool: Pool) -> None:
+        self.raw: Pool = pool
+        self.waiting: int = 0
+        self.acquires: int = 0
+        self.acquire_wait_total: float = 0.0
+        self.acquire_wait_max: float = 0.0
+
+    def acquire(self, *, timeout: Optional[float] = None) -> PoolAcquireContext:
+        return PoolAcquireContext(self, timeout)
+
+    async def run(self, query: Callable[[Connection], Awaitable[T]]) -> T:
+        async with self.acquire() as conn:
+            return await query(conn)
+
+    def record_wait(self, elapsed: float) -> None:
+        self.acquires += 1
+        self.acquire_wait_total += elapsed
+        self.acquire_wait_max = max(self.acquire_wait_max, elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        size: int = self.raw.get_size()
+        idle: int = self.raw.get_idle_size()
+        return {
+            "min_size": self.raw.get_min_size(),
+            "max_size": self.raw.get_max_size(),
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "waiting": self.waiting,
+            "acquires": self.acquires,
+            "acquire_wait_avg": (
+                self.acquire_wait_total / self.acquires if self.acquires else 0.0
+            ),
+            "acquire_wait_max": self.acquire_wait_max,
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.raw, name)
+
+
+class FallbackAcquireContext:
+    def __init__(self, pool: "FallbackPool", timeout: Optional[float]) -> None:
+        self.pool: FallbackPool = pool
+        self.timeout: Optional[float] = timeout
+        self.context: Optional[PoolAcquireContext] = None
+        self.on_replica: bool = False
+
+    async def __aenter__(self) -> Connection:
+        if self.pool.replica_available():
+            self.context = self.pool.replica.acquire(timeout=self.timeout)
+            try:
+                conn: Connection = await self.context.__aenter__()
+                self.on_replica = True
+                return conn
+            except REPLICA_ERRORS:
+                logger.warning("Read replica unavailable, falling back to primary")
+                self.pool.mark_replica_down()
+        self.context = self.pool.primary.acquire(timeout=self.timeout)
+        return await self.context.__aenter__()
+
+    async def __aexit__(self, *exc: Any) -> None:
+        if self.on_replica and isinstance(exc[1], REPLICA_ERRORS):
+            logger.warning("Lost read replica connection")
+            self.pool.mark_replica_down()
+        await self.context.__aexit__(*exc)
+
+
+class FallbackPool:
+    def __init__(
+        self, replica: MonitoredPool, primary: MonitoredPool, cooldown: float = 30.0
+    ) -> None:
+        self.replica: MonitoredPool = replica
+        self.primary: MonitoredPool = primary
+        self.cooldown: float = cooldown
+        self.fallbacks: int = 0
+        self._retry_at: float = 0.0
+
+    def acquire(self, *, timeout: Optional[float] = None) -> FallbackAcquireContext:
+        return FallbackAcquireContext(self, timeout)
+
+    async def run(self, query: Callable[[Connection], Awaitable[T]]) -> T:
+        if self.replica_available():
+            try:
+                async with self.replica.acquire() as conn:
+                    return await query(conn)
+            except REPLICA_ERRORS:
+                logger.warning("Read replica failed, retrying on primary")
+                self.mark_replica_down()
+        return await self.primary.run(query)
+
+    def replica_available(self) -> bool:
+        return monotonic() >= self._retry_at
+
+    def mark_replica_down(self) -> None:
+        self.fallbacks += 1
+        self._retry_at = monotonic() + self.cooldown
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.replica.stats(),
+            "replica_available": self.replica_available(),
+            "fallbacks": self.fallbacks,
+        }
+
+    async def close(self) -> None:
+        await self.replica.close()
+
+
+async def _create_pool(
+    dsn: str,
+    min_size: int,
+    max_size: int,
+    max_inactive_connection_lifetime: float,
+    statement_cache_size: int,
+    statement_timeout_ms: int,
+    jit: bool,
+) -> MonitoredPool:
+    pool: Pool = await create_pool(
+        dsn,
+        min_size=min_size,
+        max_size=max_size,
+        max_inactive_connection_lifetime=max_inactive_connection_lifetime,
+        statement_cache_size=statement_cache_size,
+        connection_class=PreparedConnection,
+        init=prepare_statements,
+        server_settings={
+            "application_name": "urlshortener",
+            "statement_timeout": str(statement_timeout_ms),
+            "jit": "on" if jit else "off",
+        },
+    )
+    return MonitoredPool(pool)
 
 
-async def db_connect(app: FastAPI) -> None:
-    app.state.pool: Pool = await create_pool(DATABASE_URL)
+async def db_connect(
+    app: FastAPI,
+    min_size: int = 5,
+    max_size: int = 20,
+    max_inactive_connection_lifetime: float = 300.0,
+    statement_cache_size: int = 1024,
+    statement_timeout_ms: int = 30000,
+    jit: bool = False,
+    replica_url: Optional[str] = None,
+) -> None:
+    settings: Dict[str, Any] = {
+        "min_size": min_size,
+        "max_size": max_size,
+        "max_inactive_connection_lifetime": max_inactive_connection_lifetime,
+        "statement_cache_size": statement_cache_size,
+        "statement_timeout_ms": statement_timeout_ms,
+        "jit": jit,
+    }
+    app.state.pool: MonitoredPool = await _create_pool(DATABASE_URL, **settings)
+    app.state.read_pool: MonitoredPool | FallbackPool = app.state.pool
+    if replica_url:
+        try:
+            replica: MonitoredPool = await _create_pool(
+                replica_url, **{**settings, "min_size": 0}
+            )
+        except (OSError, asyncio.TimeoutError, PostgresConnectionError):
+            logger.warning("Read replica unavailable at startup, using primary")
+        else:
+            app.state.read_pool = FallbackPool(replica, app.state.pool)
 
 
 async def db_close(app: FastAPI) -> None:
+    if app.state.read_pool is not app.state.pool:
+        await app.state.read_pool.close()
     await app.state.pool.close()
@@ -0,0 +1,378 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Union
+
+from asyncpg import Connection, Pool
+
+from database.tables import tables_list
+
+MIGRATIONS_LOCK_ID: int = 7_305_011
+LOCK_POLL_INTERVAL: float = 1.0
+
+Statement = Union[str, Callable[[Connection], Awaitable[None]]]
+
+
+class Migration:
+    def __init__(
+        self,
+        version: int,
+        name: str,
+        statements: List[Statement],
+        transactional: bool = True,
+    ) -> None:
+        self.version: int = version
+        self.name: str = name
+        self.statements: List[Statement] = statements
+        self.transactional: bool = transactional
+
+
+async def _create_index_concurrently(conn: Connection, name: str, target: str) -> None:
+    valid: Optional[bool] = await conn.fetchval(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", name
+    )
+    if valid is False:
+        await conn.execute(f"DROP INDEX CONCURRENTLY {name}")
+    await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}")
+
+
+def _concurrent_index(name: str, target: str) -> Statement:
+    async def create(conn: Connection) -> None:
+        await _create_index_concurrently(conn, name, target)
+
+    return create
+
+
+async def _index_click_partitions(conn: Connection) -> None:
+    partitions: List[str] = [
+        row["relname"]
+        for row in await conn.fetch(
+            """
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'clicks'::regclass
+            """
+        )
+    ]
+    for partition in partitions:
+        index: str = f"{partition}_url_id_clicked_at_id_idx"
+        await _create_index_concurrently(
+            conn, index, f"{partition} (url_id, clicked_at, id)"
+        )
+        attached: bool = await conn.fetchval(
+            """
+            SELECT EXISTS (
+                SELECT 1 FROM pg_inherits
+                WHERE inhrelid = $1::regclass
+                    AND inhparent = 'clicks_url_id_clicked_at_id_idx'::regclass
+            )
+            """,
+            index,
+        )
+        if not attached:
+            await conn.execute(
+                f"ALTER INDEX clicks_url_id_clicked_at_id_idx ATTACH PARTITION {index}"
+            )
+
+
+migrations_list: List[Migration] = [
+    Migration(1, "initial_schema", tables_list),
+    Migration(
+        2,
+        "query_indexes",
+        [
+            _concurrent_index(
+                "clicks_url_id_clicked_at_idx", "clicks (url_id, clicked_at)"
+            ),
+            _concurrent_index("urls_user_id_id_idx", "urls (user_id, id)"),
+        ],
+        transactional=False,
+    ),
+    Migration(
+        3,
+        "partition_clicks",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS click_partitions(
+                name VARCHAR(63) PRIMARY KEY,
+                range_start TIMESTAMP NOT NULL,
+                range_end TIMESTAMP NOT NULL
+            )
+            """,
+            """
+            INSERT INTO click_partitions (name, range_start, range_end)
+            VALUES (
+                'clicks_legacy',
+                '-infinity',
+                date_trunc('month', timezone('UTC', now())) + INTERVAL '1 month'
+            )
+            ON CONFLICT (name) DO NOTHING
+            """,
+            """
+            UPDATE clicks SET clicked_at = 'epoch'
+            WHERE clicked_at IS NULL AND to_regclass('clicks_legacy') IS NULL
+            """,
+            """
+            DO $$
+            BEGIN
+                IF to_regclass('clicks_legacy') IS NULL AND NOT EXISTS (
+                    SELECT 1 FROM pg_constraint WHERE conname = 'clicks_legacy_range'
+                ) THEN
+                    EXECUTE format(
+                        'ALTER TABLE clicks ADD CONSTRAINT clicks_legacy_range '
+                        'CHECK (clicked_at IS NOT NULL AND clicked_at < %L) NOT VALID',
+                        (SELECT range_end FROM click_partitions
+                         WHERE name = 'clicks_legacy')
+                    );
+                END IF;
+            END $$
+            """,
+            """
+            DO $$
+            BEGIN
+                IF to_regclass('clicks_legacy') IS NULL THEN
+                    ALTER TABLE clicks VALIDATE CONSTRAINT clicks_legacy_range;
+                END IF;
+            END $$
+            """,
+            """
+            DO $$
+            BEGIN
+                IF to_regclass('clicks_legacy') IS NOT NULL THEN
+                    RETURN;
+                END IF;
+                ALTER TABLE clicks RENAME TO clicks_legacy;
+                ALTER INDEX IF EXISTS clicks_url_id_clicked_at_idx
+                    RENAME TO clicks_legacy_url_id_clicked_at_idx;
+                ALTER TABLE clicks_legacy ALTER COLUMN clicked_at SET NOT NULL;
+                CREATE TABLE clicks(
+                    id INTEGER NOT NULL DEFAULT nextval('clicks_id_seq'),
+                    url_id INTEGER NOT NULL REFERENCES urls(id) ON DELETE CASCADE,
+                    clicked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    browser VARCHAR(64),
+                    device VARCHAR(64),
+                    os VARCHAR(64),
+                    ip INTEGER REFERENCES ip_addresses(id) ON DELETE CASCADE
+                ) PARTITION BY RANGE (clicked_at);
+                ALTER SEQUENCE clicks_id_seq OWNED BY clicks.id;
+                CREATE INDEX clicks_url_id_clicked_at_idx
+                    ON clicks (url_id, clicked_at);
+                EXECUTE format(
+                    'ALTER TABLE clicks ATTACH PARTITION clicks_legacy '
+                    'FOR VALUES FROM (MINVALUE) TO (%L)',
+                    (SELECT range_end FROM click_partitions
+                     WHERE name = 'clicks_legacy')
+                );
+                CREATE TABLE clicks_default PARTITION OF clicks DEFAULT;
+            END $$
+            """,
+        ],
+        transactional=False,
+    ),
+    Migration(
+        4,
+        "short_code_sequence",
+        ["CREATE SEQUENCE IF NOT EXISTS short_code_seq INCREMENT BY 1000"],
+    ),
+    Migration(
+        5,
+        "url_click_counters",
+        [
+            """
+            ALTER TABLE urls
+                ADD COLUMN IF NOT EXISTS click_count BIGINT NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS last_clicked_at TIMESTAMP
+            """,
+            """
+            UPDATE urls SET click_count = c.total, last_clicked_at = c.last_clicked_at
+            FROM (
+                SELECT url_id, COUNT(*) AS total, MAX(clicked_at) AS last_clicked_at
+                FROM clicks
+                GROUP BY url_id
+            ) c
+            WHERE urls.id = c.url_id
+            """,
+        ],
+    ),
+    Migration(
+        6,
+        "exact_small_sketches",
+        [
+            """
+            CREATE OR REPLACE FUNCTION hll_hash(id BIGINT) RETURNS BIGINT
+            LANGUAGE plpgsql IMMUTABLE STRICT AS $$
+            DECLARE
+                h BIGINT := id & 4294967295;
+            BEGIN
+                h := h # (h >> 16);
+                h := (h * 51819 + (((h * 34283) & 65535) << 16)) & 4294967295;
+                h := h # (h >> 13);
+                h := (h * 44597 + (((h * 49842) & 65535) << 16)) & 4294967295;
+                RETURN h # (h >> 16);
+            END $$
+            """,
+            """
+            CREATE OR REPLACE FUNCTION hll_ids(s BYTEA) RETURNS SETOF INTEGER
+            LANGUAGE sql IMMUTABLE STRICT AS $$
+                SELECT (
+                    get_byte(s, k)::bigint << 24 | get_byte(s, k + 1) << 16
+                    | get_byte(s, k + 2) << 8 | get_byte(s, k + 3)
+                )::integer
+                FROM generate_series(1, length(s) - 4, 4) AS k
+            $$
+            """,
+            """
+            CREATE OR REPLACE FUNCTION hll_exact(ids INTEGER[]) RETURNS BYTEA
+            LANGUAGE sql IMMUTABLE AS $$
+                SELECT '\\x00'::bytea || COALESCE(
+                    string_agg(int4send(id), ''::bytea ORDER BY id), ''::bytea
+                )
+                FROM (SELECT DISTINCT unnest(ids) AS id) AS distinct_ids
+                WHERE id IS NOT NULL
+            $$
+            """,
+            """
+            CREATE OR REPLACE FUNCTION hll_dense(s BYTEA) RETURNS BYTEA
+            LANGUAGE sql IMMUTABLE STRICT AS $$
+                SELECT CASE WHEN get_byte(s, 0) = 1 THEN s ELSE (
+                    SELECT '\\x01'::bytea || decode(
+                        string_agg(
+                            lpad(to_hex(COALESCE(r.rank, 0)), 2, '0'), '' ORDER BY g.i
+                        ),
+                        'hex'
+                    )
+                    FROM generate_series(0, 1023) AS g(i)
+                    LEFT JOIN (
+                        SELECT h >> 22 AS idx,
+                            MAX(
+                                23 - length(ltrim((h & 4194303)::bit(22)::text, '0'))
+                            ) AS rank
+                        FROM (SELECT hll_hash(id) AS h FROM hll_ids(s) AS id) AS x
+                        GROUP BY 1
+                    ) AS r ON r.idx = g.i
+                ) END
+            $$
+            """,
+            """
+            CREATE OR REPLACE FUNCTION hll_from_ids(ids INTEGER[]) RETURNS BYTEA
+            LANGUAGE sql IMMUTABLE AS $$
+                SELECT CASE
+                    WHEN COALESCE(cardinality(ids), 0) <= 255 THEN hll_exact(ids)
+                    ELSE hll_dense(hll_exact(ids))
+                END
+            $$
+            """,
+            """
+            CREATE OR REPLACE FUNCTION hll_union(a BYTEA, b BYTEA) RETURNS BYTEA
+            LANGUAGE plpgsql IMMUTABLE STRICT AS $$
+            BEGIN
+                IF get_byte(a, 0) = 0 AND get_byte(b, 0) = 0 THEN
+                    RETURN hll_from_ids(
+                        ARRAY(SELECT hll_ids(a) UNION SELECT hll_ids(b))
+                    );
+                END IF;
+                a := hll_dense(a);
+                b := hll_dense(b);
+                RETURN '\\x01'::bytea || (
+                    SELECT decode(
+                        string_agg(
+                            lpad(to_hex(greatest(get_byte(a, i), get_byte(b, i))), 2, '0'),
+                            '' ORDER BY i
+                        ),
+                        'hex'
+                    )
+                    FROM generate_series(1, 1024) AS i
+                );
+            END $$
+            """,
+            "TRUNCATE click_rollups",
+            """
+            INSERT INTO click_rollups (url_id, bucket, dimension, value, total, visitors)
+            SELECT
+                c.url_id,
+                date_trunc('hour', c.clicked_at),
+                d.dimension,
+                COALESCE(d.value, ''),
+                COUNT(*),
+                hll_from_ids(array_agg(DISTINCT c.ip) FILTER (WHERE c.ip IS NOT NULL))
+            FROM clicks c
+            LEFT JOIN ip_addresses i ON i.id = c.ip
+            CROSS JOIN LATERAL (
+                VALUES
+                    ('browser', c.browser),
+                    ('os', c.os),
+                    ('device', c.device),
+                    ('country', i.country),
+                    ('guests', NULL),
+                    ('proxy', CASE WHEN i.is_proxy THEN '' END)
+            ) d(dimension, value)
+            WHERE d.dimension <> 'proxy' OR i.is_proxy
+            GROUP BY 1, 2, 3, 4
+            """,
+        ],
+    ),
+    Migration(
+        7,
+        "clicks_export_index",
+        [
+            """
+            CREATE INDEX IF NOT EXISTS clicks_url_id_clicked_at_id_idx
+            ON ONLY clicks (url_id, clicked_at, id)
+            """,
+            _index_click_partitions,
+            "DROP INDEX IF EXISTS clicks_url_id_clicked_at_idx",
+        ],
+        transactional=False,
+    ),
+]
+
+
+async def _applied_version(conn: Connection) -> int:
+    return await conn.fetchval(
+        "SELECT COALESCE(MAX(version), 0) FROM schema_migrations"
+    )
+
+
+async def _apply(conn: Connection, migration: Migration) -> None:
+    for statement in migration.statements:
+        if callable(statement):
+            await statement(conn)
+        else:
+            await conn.execute(statement)
+    await conn.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+        migration.version,
+        migration.name,
+    )
+
+
+async def run_migrations(pool: Pool) -> None:
+    async with pool.acquire() as conn:
+        await conn.execute("SET statement_timeout = 0")
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations(
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(128) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        if await _applied_version(conn) >= migrations_list[-1].version:
+            return
+
+        while not await conn.fetchval(
+            "SELECT pg_try_advisory_lock($1)", MIGRATIONS_LOCK_ID
+        ):
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        try:
+            applied: int = await _applied_version(conn)
+            for migration in migrations_list:
+                if migration.version <= applied:
+                    continue
+                if migration.transactional:
+                    async with conn.transaction():
+                        await _apply(conn, migration)
+                else:
+                    await _apply(conn, migration)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+    await pool.expire_connections()
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from asyncpg import Pool, Record
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS_LOCK_ID: int = 7_305_012
+
+
+class ClickPartitionManager:
+    def __init__(
+        self,
+        pool: Pool,
+        interval: str = "month",
+        premake: int = 3,
+        retention: Optional[timedelta] = None,
+        check_interval: float = 3600.0,
+    ) -> None:
+        if interval not in ("week", "month"):
+            raise ValueError("interval must be 'week' or 'month'")
+        self.pool: Pool = pool
+        self.interval: str = interval
+        self.premake: int = premake
+        self.retention: Optional[timedelta] = retention
+        self.check_interval: float = check_interval
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        await self.run_once()
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+        worker, self._worker = self._worker, None
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+    async def run_once(self) -> None:
+        now: datetime = datetime.utcnow()
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "SELECT pg_advisory_xact_lock($1)", PARTITIONS_LOCK_ID
+                )
+                start: Optional[datetime] = await conn.fetchval(
+                    "SELECT MAX(range_end) FROM click_partitions"
+                )
+                if start is None:
+                    start = self._period_start(now)
+                horizon: datetime = self._period_start(now)
+                for _ in range(self.premake + 1):
+                    horizon = self._next_boundary(horizon)
+                while start < horizon:
+                    end: datetime = self._next_boundary(start)
+                    name: str = f"clicks_p{start:%Y%m%d}"
+                    await conn.execute(
+                        f"""
+                        CREATE TABLE IF NOT EXISTS {name} PARTITION OF clicks
+                        FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+                        """
+                    )
+                    await conn.execute(
+                        """
+                        INSERT INTO click_partitions (name, range_start, range_end)
+                        VALUES ($1, $2, $3) ON CONFLICT (name) DO NOTHING
+                        """,
+                        name,
+                        start,
+                        end,
+                    )
+                    start = end
+
+                if self.retention is None:
+                    return
+                expired: List[Record] = await conn.fetch(
+                    "SELECT name FROM click_partitions WHERE range_end <= $1",
+                    now - self.retention,
+                )
+                for row in expired:
+                    await conn.execute(f"DROP TABLE IF EXISTS {row['name']}")
+                    await conn.execute(
+                        "DELETE FROM click_partitions WHERE name = $1", row["name"]
+                    )
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Failed to maintain click partitions")
+
+    def _period_start(self, moment: datetime) -> datetime:
+        day: datetime = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.interval == "week":
+            return day - timedelta(days=day.weekday())
+        return day.replace(day=1)
+
+    def _next_boundary(self, moment: datetime) -> datetime:
+        if self.interval == "week":
+            return moment + timedelta(days=7)
+        if moment.month == 12:
+            return moment.replace(year=moment.year + 1, month=1, day=1)
+        return moment.replace(month=moment.month + 1, day=1)
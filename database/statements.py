@@ -0,0 +1,35 @@
+import logging
+from typing import Dict
+
+from asyncpg import Connection, PostgresError
+from asyncpg.prepared_stmt import PreparedStatement
+
+logger = logging.getLogger(__name__)
+
+QUERIES: Dict[str, str] = {}
+
+
+def register_queries(queries: Dict[str, str]) -> Dict[str, str]:
+    QUERIES.update(queries)
+    return queries
+
+
+class PreparedConnection(Connection):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.prepared: Dict[str, PreparedStatement] = {}
+
+    async def statement(self, name: str) -> PreparedStatement:
+        statement: PreparedStatement = self.prepared.get(name)
+        if statement is None:
+            statement = await self.prepare(QUERIES[name])
+            self.prepared[name] = statement
+        return statement
+
+
+async def prepare_statements(conn: PreparedConnection) -> None:
+    for name, query in QUERIES.items():
+        try:
+            conn.prepared[name] = await conn.prepare(query)
+        except PostgresError as e:
+            logger.debug("Deferring preparation of %s: %s", name, e)
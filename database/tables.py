@@ -1,7 +1,5 @@
 from typing import List
 
-from asyncpg import Pool
-
 tables_list: List[str] = [
     """
     CREATE TABLE IF NOT EXISTS ip_addresses(
@@ -52,6 +50,30 @@ tables_list: List[str] = [
     )
     """,
     """
+    CREATE OR REPLACE FUNCTION hll_union(a BYTEA, b BYTEA) RETURNS BYTEA
+    LANGUAGE sql IMMUTABLE STRICT AS $$
+        SELECT decode(
+            string_agg(
+                lpad(to_hex(greatest(get_byte(a, i), get_byte(b, i))), 2, '0'),
+                '' ORDER BY i
+            ),
+            'hex'
+        )
+        FROM generate_series(0, length(a) - 1) AS i
+    $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS click_rollups(
+        url_id INTEGER NOT NULL REFERENCES urls(id) ON DELETE CASCADE,
+        bucket TIMESTAMP NOT NULL,
+        dimension VARCHAR(16) NOT NULL,
+        value VARCHAR(64) NOT NULL DEFAULT '',
+        total BIGINT NOT NULL DEFAULT 0,
+        visitors BYTEA NOT NULL,
+        PRIMARY KEY (url_id, dimension, bucket, value)
+    )
+    """,
+    """
     CREATE TABLE IF NOT EXISTS api_keys(
         id SERIAL PRIMARY KEY,
         user_id INTEGER UNIQUE NOT NULL REFERENCES users(id) ON DELETE CASCADE,
@@ -62,8 +84,3 @@ tables_list: List[str] = [
     """,
 ]
 
-
-async def init_tables(pool: Pool) -> None:
-    async with pool.acquire() as conn:
-        for table in tables_list:
-            await conn.execute(table)
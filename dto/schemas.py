@@ -1,7 +1,22 @@
 from datetime import datetime, time
-from typing import Annotated, Optional
+from typing import Annotated, List, Optional
 
-from pydantic import BaseModel, EmailStr, Field, HttpUrl
+from pydantic import AfterValidator, BaseModel, EmailStr, Field, HttpUrl
+
+RESERVED_SHORT_CODES: frozenset = frozenset({"api", "docs", "redoc", "metrics"})
+
+
+def _check_short_code(value: str) -> str:
+    if value in RESERVED_SHORT_CODES:
+        raise ValueError(f"'{value}' is reserved")
+    return value
+
+
+ShortCode = Annotated[
+    str,
+    Field(min_length=3, max_length=16, pattern=r"^[a-zA-Z0-9_-]+$"),
+    AfterValidator(_check_short_code),
+]
 
 
 class RegisterReq(BaseModel):
@@ -17,9 +32,7 @@ class LoginReq(BaseModel):
 
 class UrlAddReq(BaseModel):
     original_url: HttpUrl
-    short_code: Annotated[
-        str, Field(min_length=3, max_length=16, pattern=r"^[a-zA-Z0-9_-]+$")
-    ]
+    short_code: Optional[ShortCode] = None
     password: Optional[str] = None
     valid_from: Optional[time] = None
     valid_until: Optional[time] = None
@@ -27,11 +40,13 @@ class UrlAddReq(BaseModel):
     allow_proxy: bool = True
 
 
+class UrlBulkAddReq(BaseModel):
+    urls: Annotated[List[UrlAddReq], Field(min_length=1, max_length=10000)]
+
+
 class UrlUpdateReq(BaseModel):
     original_url: Optional[HttpUrl] = None
-    short_code: Optional[
-        Annotated[str, Field(min_length=3, max_length=16, pattern=r"^[a-zA-Z0-9_-]+$")]
-    ] = None
+    short_code: Optional[ShortCode] = None
 
     password: Optional[str] = None
     valid_from: Optional[time] = None
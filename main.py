@@ -1,14 +1,20 @@
+from datetime import timedelta
+from os import getenv
+from typing import Optional
+
 from asyncpg import Pool
 from fastapi import FastAPI
 
 from database.base import db_close, db_connect
-from database.tables import init_tables
+from database.migrations import run_migrations
+from database.partitions import ClickPartitionManager
 from repositories.apikey_repository import ApiKeyRepository
 from repositories.click_repository import ClickRepository
 from repositories.ip_repository import IpRepository
 from repositories.url_repository import URLRepository
 from repositories.user_repository import UserRepository
 from routers.auth_router import router as auth_route
+from routers.metrics_router import router as metrics_route
 from routers.redirect_router import router as redirect_route
 from routers.statistic_router import router as statistic_route
 from routers.url_router import router as url_route
@@ -19,6 +25,7 @@ from services.redirect_service import RedirectService
 from services.statistic_service import StatisticService
 from services.url_service import URLService
 from services.user_service import UserService
+from utils.env import env_bool, env_float, env_int
 
 app: FastAPI = FastAPI()
 
@@ -26,27 +33,68 @@ app: FastAPI = FastAPI()
 app.include_router(auth_route, prefix="/api/auth")
 app.include_router(url_route, prefix="/api/url")
 app.include_router(statistic_route, prefix="/api/stats")
+app.include_router(metrics_route)
 app.include_router(redirect_route)
 
 
 @app.on_event("startup")
 async def startup() -> None:
-    await db_connect(app)
+    await db_connect(
+        app,
+        min_size=env_int("DB_POOL_MIN_SIZE", 5),
+        max_size=env_int("DB_POOL_MAX_SIZE", 20),
+        max_inactive_connection_lifetime=env_float("DB_POOL_MAX_IDLE_SECONDS", 300.0),
+        statement_cache_size=env_int("DB_STATEMENT_CACHE_SIZE", 1024),
+        statement_timeout_ms=env_int("DB_STATEMENT_TIMEOUT_MS", 30000),
+        jit=env_bool("DB_JIT", False),
+        replica_url=getenv("REPLICA_DATABASE_URL"),
+    )
     pool: Pool = app.state.pool
+    read_pool: Pool = app.state.read_pool
 
-    await init_tables(pool)
+    await run_migrations(pool)
+
+    retention_days: Optional[int] = env_int("CLICK_RETENTION_DAYS", None)
+    app.state.partition_manager: ClickPartitionManager = ClickPartitionManager(
+        pool,
+        interval=getenv("CLICK_PARTITION_INTERVAL", "month"),
+        premake=env_int("CLICK_PARTITION_PREMAKE", 3),
+        retention=timedelta(days=retention_days) if retention_days else None,
+    )
+    await app.state.partition_manager.start()
 
     user_repo: UserRepository = UserRepository(pool)
     apikey_repo: ApiKeyRepository = ApiKeyRepository(pool)
-    url_repo: URLRepository = URLRepository(pool)
+    url_repo: URLRepository = URLRepository(pool, read_pool)
     ip_repo: IpRepository = IpRepository(pool)
-    click_repo: ClickRepository = ClickRepository(pool)
+    click_repo: ClickRepository = ClickRepository(pool, read_pool)
 
     app.state.user_service: UserService = UserService(user_repo)
-    app.state.apikey_service: ApiKeyService = ApiKeyService(apikey_repo)
-    app.state.url_service: URLService = URLService(url_repo)
-    app.state.ip_service: IpService = IpService(ip_repo)
-    app.state.click_service: ClickService = ClickService(click_repo)
+    app.state.apikey_service: ApiKeyService = ApiKeyService(
+        apikey_repo,
+        cache_size=env_int("APIKEY_CACHE_SIZE", 10000),
+        cache_ttl=env_float("APIKEY_CACHE_TTL", 5.0),
+        negative_cache_size=env_int("APIKEY_NEGATIVE_CACHE_SIZE", 1000),
+    )
+    app.state.url_service: URLService = URLService(
+        url_repo,
+        cache_size=env_int("URL_CACHE_SIZE", 10000),
+        cache_ttl=env_float("URL_CACHE_TTL", 60.0),
+    )
+    app.state.ip_service: IpService = IpService(
+        ip_repo,
+        api_url=getenv("PROXYCHECK_URL", "https://proxycheck.io/v3/"),
+        async_enrichment=env_bool("IP_ASYNC_ENRICHMENT", False),
+        lookup_timeout=env_float("IP_LOOKUP_TIMEOUT", 2.0),
+        fail_open=env_bool("IP_LOOKUP_FAIL_OPEN", False),
+        cache_size=env_int("IP_CACHE_SIZE", 100000),
+    )
+    app.state.click_service: ClickService = ClickService(
+        click_repo,
+        ua_cache_size=env_int("UA_CACHE_SIZE", 4096),
+        ua_max_length=env_int("UA_MAX_LENGTH", 512),
+        ua_parse_workers=env_int("UA_PARSE_WORKERS", 0),
+    )
     app.state.redirect_service: RedirectService = RedirectService(
         app.state.url_service,
         app.state.click_service,
@@ -57,7 +105,13 @@ async def startup() -> None:
         app.state.url_service,
     )
 
+    await app.state.ip_service.start()
+    await app.state.click_service.start()
+
 
 @app.on_event("shutdown")
 async def shutdown() -> None:
+    await app.state.partition_manager.stop()
+    await app.state.ip_service.stop()
+    await app.state.click_service.stop()
     await db_close(app)
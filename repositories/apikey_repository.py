@@ -2,7 +2,10 @@ from typing import Optional
 
 from asyncpg import Pool
 
+from utils.metrics import timed_queries
 
+
+@timed_queries("apikey")
 class ApiKeyRepository:
     def __init__(self, pool) -> None:
         self.pool: Pool = pool
@@ -20,10 +23,13 @@ class ApiKeyRepository:
                 hashed_key,
             )
 
-    async def upsert(self, user_id: int, hashed_key: str) -> None:
+    async def upsert(self, user_id: int, hashed_key: str) -> Optional[str]:
         async with self.pool.acquire() as conn:
-            await conn.execute(
+            return await conn.fetchval(
                 """
+                WITH previous AS (
+                    SELECT key FROM api_keys WHERE user_id = $1
+                )
                 INSERT INTO api_keys (
                     user_id, key
                 ) VALUES (
@@ -33,6 +39,7 @@ class ApiKeyRepository:
                     key = EXCLUDED.key,
                     created_at = CURRENT_TIMESTAMP,
                     is_active = TRUE
+                RETURNING (SELECT key FROM previous)
                 """,
                 user_id,
                 hashed_key,
@@ -1,76 +1,292 @@
 from datetime import datetime
-from typing import Optional
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 
-from asyncpg import Pool
+from asyncpg import Connection, Pool, Record
 
+from database.statements import register_queries
+from utils.metrics import timed_queries
 
+STAT_FIELDS: Tuple[str, ...] = ("browser", "os", "device")
+
+register_queries(
+    {
+        f"click.field_stats.{field}": f"""
+            SELECT {field}, COUNT(*) AS total, COUNT(DISTINCT ip) AS unique
+            FROM clicks
+            WHERE url_id = $1
+                AND clicked_at >= COALESCE($2::timestamp, '-infinity')
+            GROUP BY {field}
+            ORDER BY total DESC
+        """
+        for field in STAT_FIELDS
+    }
+)
+
+ROLLUP_UPSERT: str = """
+    INSERT INTO click_rollups(url_id, bucket, dimension, value, total, visitors)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (url_id, dimension, bucket, value) DO UPDATE SET
+        total = click_rollups.total + EXCLUDED.total,
+        visitors = hll_union(click_rollups.visitors, EXCLUDED.visitors)
+"""
+
+ROLLUP_REBUILD: str = """
+    INSERT INTO click_rollups (url_id, bucket, dimension, value, total, visitors)
+    SELECT
+        c.url_id,
+        date_trunc('hour', c.clicked_at),
+        d.dimension,
+        COALESCE(d.value, ''),
+        COUNT(*),
+        hll_from_ids(array_agg(DISTINCT c.ip) FILTER (WHERE c.ip IS NOT NULL))
+    FROM clicks c
+    LEFT JOIN ip_addresses i ON i.id = c.ip
+    CROSS JOIN LATERAL (
+        VALUES
+            ('browser', c.browser),
+            ('os', c.os),
+            ('device', c.device),
+            ('country', i.country),
+            ('guests', NULL),
+            ('proxy', CASE WHEN i.is_proxy THEN '' END)
+    ) d(dimension, value)
+    WHERE c.url_id = $1 AND (d.dimension <> 'proxy' OR i.is_proxy)
+    GROUP BY 1, 2, 3, 4
+"""
+
+
+@timed_queries("click")
 class ClickRepository:
-    def __init__(self, pool: Pool) -> None:
+    def __init__(self, pool: Pool, read_pool: Optional[Pool] = None) -> None:
         self.pool = pool
+        self.read_pool = read_pool or pool
 
-    async def add(
+    async def add_many(
         self,
-        url_id: int,
-        ip: int,
-        browser: Optional[str],
-        device: Optional[str],
-        os: Optional[str],
+        records: Iterable[
+            Tuple[int, datetime, Optional[str], Optional[str], Optional[str], int]
+        ],
+        rollups: Iterable[Tuple[int, datetime, str, str, int, bytes]] = (),
+        counters: Iterable[Tuple[int, int, datetime]] = (),
     ) -> None:
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO clicks(url_id, ip, browser, device, os) VALUES ($1, $2, $3, $4, $5)",
-                url_id,
-                ip,
-                browser,
-                device,
-                os,
+            async with conn.transaction():
+                await conn.copy_records_to_table(
+                    "clicks",
+                    records=records,
+                    columns=["url_id", "clicked_at", "browser", "device", "os", "ip"],
+                )
+                if rollups:
+                    await conn.executemany(ROLLUP_UPSERT, rollups)
+                if counters:
+                    await conn.execute(
+                        """
+                        UPDATE urls u SET
+                            click_count = u.click_count + t.total,
+                            last_clicked_at = GREATEST(
+                                u.last_clicked_at, t.last_clicked_at
+                            )
+                        FROM unnest($1::int[], $2::int[], $3::timestamp[])
+                            AS t(url_id, total, last_clicked_at)
+                        WHERE u.id = t.url_id
+                        """,
+                        *[list(column) for column in zip(*counters)],
+                    )
+
+    async def fetch_ip_attributes(
+        self, ip_ids: Iterable[int]
+    ) -> Dict[int, Tuple[Optional[str], bool]]:
+        ip_ids = list(ip_ids)
+        if not ip_ids:
+            return {}
+        async with self.pool.acquire() as conn:
+            rows: List[Record] = await conn.fetch(
+                "SELECT id, country, is_proxy FROM ip_addresses WHERE id = ANY($1::int[])",
+                ip_ids,
             )
+            return {row["id"]: (row["country"], row["is_proxy"]) for row in rows}
 
-    async def get_field_stats(
-        self, url_id: int, field: Optional[str], since: Optional[datetime]
-    ) -> list:
+    async def rebuild_rollups(self, url_id: int) -> None:
         async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                f"""
-                SELECT {field}, COUNT(*) AS total, COUNT(DISTINCT ip) AS unique
-                FROM clicks
-                WHERE url_id = $1 AND ($2::timestamp IS NULL OR clicked_at >= $2)
-                GROUP BY {field}
+            async with conn.transaction():
+                await conn.execute("DELETE FROM click_rollups WHERE url_id = $1", url_id)
+                await conn.execute(ROLLUP_REBUILD, url_id)
+
+    async def get_rollup_stats(
+        self, url_id: int, dimensions: List[str], since: Optional[datetime]
+    ) -> List[Record]:
+        return await self.read_pool.run(
+            lambda conn: conn.fetch(
+                """
+                SELECT dimension, value,
+                    SUM(total) AS total, array_agg(visitors) AS visitors
+                FROM click_rollups
+                WHERE url_id = $1 AND dimension = ANY($2::varchar[])
+                    AND ($3::timestamp IS NULL OR bucket >= date_trunc('hour', $3))
+                GROUP BY dimension, value
                 ORDER BY total DESC
                 """,
                 url_id,
+                dimensions,
                 since,
             )
+        )
+
+    async def get_field_stats(
+        self, url_id: int, field: str, since: Optional[datetime]
+    ) -> list:
+        if field not in STAT_FIELDS:
+            raise ValueError(f"Unknown stats field: {field}")
+
+        async def query(conn: Connection) -> List[Record]:
+            statement = await conn.statement(f"click.field_stats.{field}")
+            return await statement.fetch(url_id, since)
+
+        return await self.read_pool.run(query)
 
     async def get_countries_stats(self, url_id: int, since: Optional[datetime]) -> list:
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(
+        return await self.read_pool.run(
+            lambda conn: conn.fetch(
                 """
                 SELECT i.country, COUNT(*) AS total, COUNT(DISTINCT c.ip) AS unique
                 FROM clicks c
                 LEFT JOIN ip_addresses i ON c.ip = i.id
-                WHERE c.url_id = $1 AND ($2::timestamp IS NULL OR c.clicked_at >= $2)
+                WHERE c.url_id = $1
+                    AND c.clicked_at >= COALESCE($2::timestamp, '-infinity')
                 GROUP BY i.country
                 ORDER BY total DESC
                 """,
                 url_id,
                 since,
             )
+        )
 
     async def get_guests_stats(
         self, url_id: int, since: Optional[datetime]
     ) -> Optional[dict]:
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
+        return await self.read_pool.run(
+            lambda conn: conn.fetchrow(
+                """
+                SELECT
+                    COUNT(*) AS total,
+                    COUNT(DISTINCT c.ip) AS unique,
+                    COUNT(DISTINCT CASE WHEN i.is_proxy THEN c.ip END) AS proxy
+                FROM clicks c
+                LEFT JOIN ip_addresses i ON c.ip = i.id
+                WHERE c.url_id = $1
+                    AND c.clicked_at >= COALESCE($2::timestamp, '-infinity')
+                """,
+                url_id,
+                since,
+            )
+        )
+
+    async def get_summary_stats(self, url_id: int, since: Optional[datetime]) -> list:
+        return await self.read_pool.run(
+            lambda conn: conn.fetch(
                 """
                 SELECT
+                    CASE GROUPING(c.browser, c.os, c.device, i.country)
+                        WHEN 7 THEN 'browsers'
+                        WHEN 11 THEN 'os'
+                        WHEN 13 THEN 'devices'
+                        WHEN 14 THEN 'countries'
+                        ELSE 'guests'
+                    END AS grouping_set,
+                    COALESCE(c.browser, c.os, c.device, i.country) AS value,
                     COUNT(*) AS total,
                     COUNT(DISTINCT c.ip) AS unique,
                     COUNT(DISTINCT CASE WHEN i.is_proxy THEN c.ip END) AS proxy
                 FROM clicks c
                 LEFT JOIN ip_addresses i ON c.ip = i.id
-                WHERE c.url_id = $1 AND ($2::timestamp IS NULL OR c.clicked_at >= $2)
+                WHERE c.url_id = $1
+                    AND c.clicked_at >= COALESCE($2::timestamp, '-infinity')
+                GROUP BY GROUPING SETS (
+                    (c.browser), (c.os), (c.device), (i.country), ()
+                )
+                ORDER BY total DESC
                 """,
                 url_id,
                 since,
             )
+        )
+
+    async def get_rollup_timeseries(
+        self, url_id: int, unit: str, start: datetime, end: datetime
+    ) -> List[Record]:
+        return await self.read_pool.run(
+            lambda conn: conn.fetch(
+                """
+                SELECT date_trunc($2, bucket) AS bucket,
+                    SUM(total) AS total, array_agg(visitors) AS visitors
+                FROM click_rollups
+                WHERE url_id = $1 AND dimension = 'guests'
+                    AND bucket >= $3 AND bucket < $4
+                GROUP BY 1
+                ORDER BY 1
+                """,
+                url_id,
+                unit,
+                start,
+                end,
+            )
+        )
+
+    async def get_click_timeseries(
+        self, url_id: int, unit: str, start: datetime, end: datetime
+    ) -> List[Record]:
+        return await self.read_pool.run(
+            lambda conn: conn.fetch(
+                """
+                SELECT date_trunc($2, clicked_at) AS bucket,
+                    COUNT(*) AS total, COUNT(DISTINCT ip) AS unique
+                FROM clicks
+                WHERE url_id = $1 AND clicked_at >= $3 AND clicked_at < $4
+                GROUP BY 1
+                ORDER BY 1
+                """,
+                url_id,
+                unit,
+                start,
+                end,
+            )
+        )
+
+    async def iter_export(
+        self,
+        user_id: int,
+        url_id: Optional[int],
+        since: Optional[datetime],
+        after_id: Optional[int],
+        until: datetime,
+        limit: Optional[int],
+    ) -> AsyncIterator[Record]:
+        async with self.read_pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                async for row in conn.cursor(
+                    """
+                    SELECT c.id, u.short_code, c.clicked_at,
+                        c.browser, c.device, c.os,
+                        host(i.ip_address) AS ip_address, i.country, i.region,
+                        i.city, i.provider, i.is_proxy
+                    FROM clicks c
+                    JOIN urls u ON u.id = c.url_id
+                    LEFT JOIN ip_addresses i ON i.id = c.ip
+                    WHERE u.user_id = $1
+                        AND ($2::int IS NULL OR c.url_id = $2)
+                        AND (c.clicked_at, c.id) > (
+                            COALESCE($3::timestamp, '-infinity'), COALESCE($4::int, 0)
+                        )
+                        AND c.clicked_at < $5
+                    ORDER BY c.clicked_at, c.id
+                    LIMIT $6
+                    """,
+                    user_id,
+                    url_id,
+                    since,
+                    after_id,
+                    until,
+                    limit,
+                    prefetch=1000,
+                ):
+                    yield row
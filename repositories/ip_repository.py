@@ -1,63 +1,93 @@
 from ipaddress import IPv4Address, IPv6Address
-from typing import List, Optional
+from typing import List, Optional, Set, Tuple
 
 from asyncpg import Pool
 
+from database.statements import register_queries
+from utils.metrics import timed_queries
 
+IP_COLUMNS: Tuple[str, ...] = (
+    "id",
+    "ip_address",
+    "timezone",
+    "provider",
+    "country",
+    "region",
+    "city",
+    "latitude",
+    "longitude",
+    "is_proxy",
+)
+
+register_queries(
+    {
+        "ip.by_address": f"""
+            SELECT {", ".join(IP_COLUMNS)} FROM ip_addresses WHERE ip_address = $1
+        """,
+    }
+)
+
+
+@timed_queries("ip")
 class IpRepository:
     def __init__(self, pool: Pool) -> None:
         self.pool = pool
 
-    async def exists_by_address(self, ip_address: IPv4Address | IPv6Address) -> bool:
+    async def fetch_existing_addresses(
+        self, ip_addresses: List[IPv4Address | IPv6Address]
+    ) -> Set[str]:
         async with self.pool.acquire() as conn:
-            return await conn.fetchval(
-                "SELECT EXISTS (SELECT 1 FROM ip_addresses WHERE ip_address = $1)",
-                ip_address,
+            rows = await conn.fetch(
+                "SELECT host(ip_address) AS ip FROM ip_addresses WHERE ip_address = ANY($1::inet[])",
+                ip_addresses,
             )
+            return {row["ip"] for row in rows}
 
     async def fetchrow_by_ip(
         self, ip_address: IPv4Address | IPv6Address, fields: List[str]
     ) -> Optional[dict]:
         if not fields:
             return None
-        field_list: str = ", ".join(fields)
+        unknown: List[str] = [field for field in fields if field not in IP_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                f"SELECT {field_list} FROM ip_addresses WHERE ip_address = $1",
-                ip_address,
-            )
-            return dict(row) if row else None
+            statement = await conn.statement("ip.by_address")
+            row = await statement.fetchrow(ip_address)
+            return {field: row[field] for field in fields} if row else None
 
-    async def add(
+    async def add_many(
         self,
-        ip_address: IPv4Address | IPv6Address,
-        longitude: float,
-        latitude: float,
-        is_proxy: bool,
-        timezone: str,
-        provider: str,
-        country: str,
-        region: str,
-        city: str,
+        rows: List[
+            Tuple[
+                IPv4Address | IPv6Address,
+                Optional[float],
+                Optional[float],
+                bool,
+                str,
+                str,
+                str,
+                str,
+                str,
+            ]
+        ],
     ) -> None:
+        if not rows:
+            return
+        columns: List[list] = [list(column) for column in zip(*rows)]
         async with self.pool.acquire() as conn:
-            return await conn.execute(
+            await conn.execute(
                 """
                 INSERT INTO ip_addresses(
                     ip_address, longitude, latitude, is_proxy,
                     timezone, provider, country, region, city
-                ) VALUES (
-                    $1, $2, $3, $4,
-                    $5, $6, $7, $8, $9
                 )
+                SELECT * FROM unnest(
+                    $1::inet[], $2::numeric[], $3::numeric[], $4::boolean[],
+                    $5::varchar[], $6::varchar[], $7::varchar[], $8::varchar[],
+                    $9::varchar[]
+                )
+                ON CONFLICT (ip_address) DO NOTHING
                 """,
-                ip_address,
-                longitude,
-                latitude,
-                is_proxy,
-                timezone,
-                provider,
-                country,
-                region,
-                city,
+                *columns,
             )
@@ -1,25 +1,154 @@
 from datetime import datetime, time
-from typing import Any, Dict, List, Optional
+from ipaddress import IPv4Address, IPv6Address
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 
-from asyncpg import Pool, Record
+from asyncpg import Connection, Pool, Record
 
+from database.statements import register_queries
+from utils.metrics import timed_queries
 
+URL_COLUMNS: Tuple[str, ...] = (
+    "id",
+    "user_id",
+    "original_url",
+    "short_code",
+    "created_at",
+    "expires_at",
+    "password",
+    "valid_from",
+    "valid_until",
+    "allow_proxy",
+    "click_count",
+    "last_clicked_at",
+)
+
+URL_UPDATE_COLUMNS: Tuple[str, ...] = (
+    "original_url",
+    "short_code",
+    "password",
+    "valid_from",
+    "valid_until",
+    "expires_at",
+    "allow_proxy",
+)
+
+URL_PROJECTIONS: Dict[str, Tuple[str, ...]] = {
+    "owner": ("id", "user_id"),
+    "redirect": (
+        "id",
+        "original_url",
+        "valid_from",
+        "valid_until",
+        "password",
+        "expires_at",
+        "allow_proxy",
+    ),
+    "listing": (
+        "id",
+        "original_url",
+        "short_code",
+        "password",
+        "created_at",
+        "expires_at",
+        "valid_from",
+        "valid_until",
+        "allow_proxy",
+        "click_count",
+        "last_clicked_at",
+    ),
+    "detail": URL_COLUMNS,
+}
+
+_REDIRECT_COLUMNS: Tuple[str, ...] = URL_PROJECTIONS["redirect"]
+
+register_queries(
+    {
+        **{
+            f"url.by_short_code.{name}": f"""
+                SELECT {", ".join(columns)} FROM urls WHERE short_code = $1
+            """
+            for name, columns in URL_PROJECTIONS.items()
+        },
+        "url.with_ip": f"""
+            SELECT {", ".join(f"u.{column}" for column in _REDIRECT_COLUMNS)},
+                i.id AS ip_id, i.is_proxy AS ip_is_proxy, i.country AS ip_country
+            FROM urls u
+            LEFT JOIN ip_addresses i ON i.ip_address = $2::inet
+            WHERE u.short_code = $1
+        """,
+        "url.listing": f"""
+            SELECT {", ".join(URL_PROJECTIONS["listing"])} FROM urls
+            WHERE user_id = $1
+                AND id > COALESCE($2::int, 0)
+                AND (
+                    $3::text IS NULL
+                    OR ($3 = 'active') = (expires_at > timezone('UTC', now()))
+                )
+                AND created_at >= COALESCE($4::timestamp, '-infinity')
+                AND created_at < COALESCE($5::timestamp, 'infinity')
+            ORDER BY id
+            LIMIT $6
+        """,
+        "url.owned_by": """
+            SELECT EXISTS (SELECT 1 FROM urls WHERE short_code = $1 AND user_id = $2)
+        """,
+        "url.update": """
+            UPDATE urls SET
+                original_url = CASE WHEN 'original_url' = ANY($3::text[])
+                    THEN $4::varchar ELSE original_url END,
+                short_code = CASE WHEN 'short_code' = ANY($3)
+                    THEN $5::varchar ELSE short_code END,
+                password = CASE WHEN 'password' = ANY($3)
+                    THEN $6::varchar ELSE password END,
+                valid_from = CASE WHEN 'valid_from' = ANY($3)
+                    THEN $7::time ELSE valid_from END,
+                valid_until = CASE WHEN 'valid_until' = ANY($3)
+                    THEN $8::time ELSE valid_until END,
+                expires_at = CASE WHEN 'expires_at' = ANY($3)
+                    THEN $9::timestamp ELSE expires_at END,
+                allow_proxy = CASE WHEN 'allow_proxy' = ANY($3)
+                    THEN $10::boolean ELSE allow_proxy END
+            WHERE short_code = $1 AND user_id = $2
+            RETURNING TRUE
+        """,
+    }
+)
+
+
+def _check_columns(fields: List[str], allowed: Tuple[str, ...]) -> None:
+    unknown: List[str] = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+
+def _projection(fields: List[str]) -> str:
+    _check_columns(fields, URL_COLUMNS)
+    for name, columns in URL_PROJECTIONS.items():
+        if all(field in columns for field in fields):
+            return name
+
+
+@timed_queries("url")
 class URLRepository:
-    def __init__(self, pool: Pool) -> None:
+    def __init__(self, pool: Pool, read_pool: Optional[Pool] = None) -> None:
         self.pool: Pool = pool
+        self.read_pool: Pool = read_pool or pool
 
-    async def shortcode_exists(self, short_code: str) -> bool:
+    async def allocate_code_block(self) -> Tuple[int, int]:
         async with self.pool.acquire() as conn:
-            return await conn.fetchval(
-                "SELECT EXISTS (SELECT 1 FROM urls WHERE short_code = $1)", short_code
+            row: Record = await conn.fetchrow(
+                """
+                SELECT nextval('short_code_seq') AS start, increment_by AS size
+                FROM pg_sequences
+                WHERE schemaname = current_schema() AND sequencename = 'short_code_seq'
+                """
             )
+            return row["start"], row["start"] + row["size"]
 
-    async def exists_by_user_and_url(self, user_id: int, original_url: str) -> bool:
+    async def shortcode_exists(self, short_code: str) -> bool:
         async with self.pool.acquire() as conn:
             return await conn.fetchval(
-                "SELECT EXISTS (SELECT 1 FROM urls WHERE user_id = $1 AND original_url = $2)",
-                user_id,
-                original_url,
+                "SELECT EXISTS (SELECT 1 FROM urls WHERE short_code = $1)", short_code
             )
 
     async def add(
@@ -32,7 +161,7 @@ class URLRepository:
         valid_until: Optional[time],
         expires_at: Optional[datetime],
         allow_proxy: bool,
-    ) -> int:
+    ) -> Optional[int]:
         async with self.pool.acquire() as conn:
             return await conn.fetchval(
                 """
@@ -41,8 +170,10 @@ class URLRepository:
                     password, valid_from, valid_until, 
                     expires_at, allow_proxy
                 ) VALUES (
-                    $1, $2, $3, $4, $5, $6, $7, $8
-                ) RETURNING id
+                    $1, $2, $3, $4, $5, $6,
+                    COALESCE($7, CURRENT_TIMESTAMP + INTERVAL '30 days'), $8
+                ) ON CONFLICT DO NOTHING
+                RETURNING id
                 """,
                 user_id,
                 original_url,
@@ -54,46 +185,176 @@ class URLRepository:
                 allow_proxy,
             )
 
-    async def update_by_shortcode(self, short_code: str, fields: Dict[str, Any]):
-        if not fields:
-            return
-        set_expression: str = ", ".join(
-            f"{key} = ${i + 2}" for i, key in enumerate(fields.keys())
+    async def add_many(
+        self,
+        user_id: int,
+        rows: List[
+            Tuple[
+                str,
+                str,
+                Optional[str],
+                Optional[time],
+                Optional[time],
+                Optional[datetime],
+                bool,
+            ]
+        ],
+    ) -> Tuple[Set[str], Set[str], Set[str]]:
+        if not rows:
+            return set(), set(), set()
+        columns: List[list] = [list(column) for column in zip(*rows)]
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                taken_codes: List[Record] = await conn.fetch(
+                    "SELECT short_code FROM urls WHERE short_code = ANY($1::varchar[])",
+                    columns[1],
+                )
+                taken_urls: List[Record] = await conn.fetch(
+                    """
+                    SELECT original_url FROM urls
+                    WHERE user_id = $1 AND original_url = ANY($2::varchar[])
+                    """,
+                    user_id,
+                    columns[0],
+                )
+                inserted: List[Record] = await conn.fetch(
+                    """
+                    INSERT INTO urls (
+                        user_id, original_url, short_code,
+                        password, valid_from, valid_until,
+                        expires_at, allow_proxy
+                    )
+                    SELECT
+                        $1, t.original_url, t.short_code,
+                        t.password, t.valid_from, t.valid_until,
+                        COALESCE(
+                            t.expires_at, CURRENT_TIMESTAMP + INTERVAL '30 days'
+                        ),
+                        t.allow_proxy
+                    FROM unnest(
+                        $2::varchar[], $3::varchar[], $4::varchar[], $5::time[],
+                        $6::time[], $7::timestamp[], $8::boolean[]
+                    ) AS t(
+                        original_url, short_code, password, valid_from,
+                        valid_until, expires_at, allow_proxy
+                    )
+                    ON CONFLICT DO NOTHING
+                    RETURNING short_code
+                    """,
+                    user_id,
+                    *columns,
+                )
+        return (
+            {row["short_code"] for row in taken_codes},
+            {row["original_url"] for row in taken_urls},
+            {row["short_code"] for row in inserted},
         )
-        values: list = list(fields.values())
+
+    async def update_by_shortcode(
+        self, short_code: str, user_id: int, fields: Dict[str, Any]
+    ) -> bool:
+        _check_columns(list(fields), URL_UPDATE_COLUMNS)
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                f"UPDATE urls SET {set_expression} WHERE short_code = $1",
-                short_code,
-                *values,
+            if not fields:
+                statement = await conn.statement("url.owned_by")
+                return await statement.fetchval(short_code, user_id)
+            statement = await conn.statement("url.update")
+            return bool(
+                await statement.fetchval(
+                    short_code,
+                    user_id,
+                    list(fields),
+                    *(fields.get(column) for column in URL_UPDATE_COLUMNS),
+                )
             )
 
     async def fetchrow_by_shortcode(
-        self, short_code: str, fields: List[str]
+        self, short_code: str, fields: List[str], replica: bool = False
     ) -> Optional[dict]:
         if not fields:
             return
-        field_list: str = ", ".join(fields)
+        projection: str = _projection(fields)
+        pool: Pool = self.read_pool if replica else self.pool
+
+        async def query(conn: Connection) -> Optional[Record]:
+            statement = await conn.statement(f"url.by_short_code.{projection}")
+            return await statement.fetchrow(short_code)
+
+        row: Optional[Record] = await pool.run(query)
+        return {field: row[field] for field in fields} if row else None
+
+    async def fetchrow_with_ip(
+        self,
+        short_code: str,
+        ip_address: Optional[IPv4Address | IPv6Address],
+        fields: List[str],
+    ) -> Tuple[Optional[dict], Optional[dict]]:
+        _check_columns(fields, URL_PROJECTIONS["redirect"])
         async with self.pool.acquire() as conn:
-            row: Record = await conn.fetchrow(
-                f"SELECT {field_list} FROM urls WHERE short_code = $1", short_code
+            statement = await conn.statement("url.with_ip")
+            row: Record = await statement.fetchrow(short_code, ip_address)
+            if not row:
+                return None, None
+            ip_row: Optional[dict] = (
+                {
+                    "id": row["ip_id"],
+                    "is_proxy": row["ip_is_proxy"],
+                    "country": row["ip_country"],
+                }
+                if row["ip_id"] is not None
+                else None
             )
-            return dict(row) if row else None
+            return {field: row[field] for field in fields}, ip_row
 
     async def fetch_by_user_id(
         self,
         user_id: int,
-    ) -> List[dict]:
-        async with self.pool.acquire() as conn:
-            rows: List[Record] = await conn.fetch(
-                "SELECT * FROM urls WHERE user_id = $1", user_id
+        fields: List[str],
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        status: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+    ) -> List[Record]:
+        _check_columns(fields, URL_PROJECTIONS["listing"])
+
+        async def query(conn: Connection) -> List[Record]:
+            statement = await conn.statement("url.listing")
+            return await statement.fetch(
+                user_id, after_id, status, created_from, created_to, limit
             )
-            return [dict(row) for row in rows]
 
-    async def delete_by_user_id(self, user_id: int) -> int:
+        return await self.read_pool.run(query)
+
+    async def iter_by_user_id(
+        self,
+        user_id: int,
+        fields: List[str],
+        status: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+    ) -> AsyncIterator[Record]:
+        _check_columns(fields, URL_PROJECTIONS["listing"])
+        async with self.read_pool.acquire() as conn:
+            statement = await conn.statement("url.listing")
+            async with conn.transaction(readonly=True):
+                async for row in statement.cursor(
+                    user_id,
+                    None,
+                    status,
+                    created_from,
+                    created_to,
+                    None,
+                    prefetch=500,
+                ):
+                    yield row
+
+    async def delete_by_user_id(self, user_id: int) -> List[str]:
         async with self.pool.acquire() as conn:
-            r: str = await conn.execute("DELETE FROM urls WHERE user_id = $1", user_id)
-            return int(r.split(" ")[1])
+            rows: List[Record] = await conn.fetch(
+                "DELETE FROM urls WHERE user_id = $1 RETURNING short_code", user_id
+            )
+            return [row["short_code"] for row in rows]
 
     async def delete_by_shortcode(self, short_code: str) -> None:
         async with self.pool.acquire() as conn:
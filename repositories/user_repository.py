@@ -2,7 +2,10 @@ from typing import Optional
 
 from asyncpg import Pool, Record
 
+from utils.metrics import timed_queries
 
+
+@timed_queries("user")
 class UserRepository:
     def __init__(self, pool: Pool) -> None:
         self.pool = pool
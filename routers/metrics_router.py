@@ -0,0 +1,48 @@
+from typing import Dict, List
+
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from utils.metrics import QUERY_SECONDS, STAGE_SECONDS, render_gauges, render_metrics
+
+router: APIRouter = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    state = request.app.state
+    pools: Dict[str, dict] = {"primary": state.pool.stats()}
+    if state.read_pool is not state.pool:
+        pools["replica"] = state.read_pool.stats()
+
+    gauges: List[str] = [
+        *render_gauges("db_pool", "pool", pools, counters=("acquires", "fallbacks")),
+        *render_gauges(
+            "cache",
+            "cache",
+            {
+                "redirect": state.url_service.redirect_cache.stats(),
+                "ip": state.ip_service.ip_cache.stats(),
+                "apikey": state.apikey_service.key_cache.stats(),
+                "apikey_negative": state.apikey_service.negative_cache.stats(),
+                "user_agent": state.click_service.ua_cache.stats(),
+            },
+            counters=("hits", "misses", "evictions"),
+        ),
+        *render_gauges(
+            "click_queue",
+            "queue",
+            {"clicks": state.click_service.queue_stats()},
+            counters=("enqueued", "dropped", "flushed", "failed"),
+        ),
+        *render_gauges(
+            "upstream",
+            "service",
+            {"proxycheck": state.ip_service.upstream_stats()},
+            counters=("requests", "errors"),
+        ),
+    ]
+    return PlainTextResponse(
+        render_metrics([STAGE_SECONDS, QUERY_SECONDS], gauges),
+        media_type="text/plain; version=0.0.4",
+    )
@@ -1,6 +1,8 @@
-from typing import Optional
+from datetime import datetime
+from typing import Literal, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 
 from utils.exceptions import ServiceError
 from utils.security import authorize_user
@@ -76,3 +78,56 @@ async def get_guests_stats_by_shortcode(
         return await statistic_service.get_guests_stats(user_id, short_code, period)
     except ServiceError as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
+
+
+@router.get("/summary")
+async def get_summary_stats_by_shortcode(
+    short_code: str,
+    request: Request,
+    period: Optional[str] = Query(default=None, enum=["day", "week", "month"]),
+    user_id: int = Depends(authorize_user),
+):
+    statistic_service = request.app.state.statistic_service
+    try:
+        return await statistic_service.get_summary_stats(user_id, short_code, period)
+    except ServiceError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+
+@router.get("/timeseries")
+async def get_timeseries_by_shortcode(
+    short_code: str,
+    request: Request,
+    start: datetime = Query(alias="from"),
+    end: Optional[datetime] = Query(default=None, alias="to"),
+    bucket: Literal["minute", "hour", "day"] = "hour",
+    user_id: int = Depends(authorize_user),
+):
+    statistic_service = request.app.state.statistic_service
+    try:
+        return await statistic_service.get_timeseries(
+            user_id, short_code, start, end, bucket
+        )
+    except ServiceError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+
+@router.get("/export")
+async def export_clicks(
+    request: Request,
+    short_code: Optional[str] = None,
+    format: str = Query(default="csv", enum=["csv", "ndjson"]),
+    after_id: Optional[int] = Query(default=None, ge=0),
+    since: Optional[datetime] = None,
+    limit: Optional[int] = Query(default=None, ge=1),
+    user_id: int = Depends(authorize_user),
+):
+    statistic_service = request.app.state.statistic_service
+    try:
+        chunks = await statistic_service.export_clicks(
+            user_id, short_code, format, after_id, since, limit
+        )
+    except ServiceError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    media_type: str = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(chunks, media_type=media_type)
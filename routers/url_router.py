@@ -1,6 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from datetime import datetime
+from typing import List, Literal, Optional
 
-from dto.schemas import UrlAddReq, UrlUpdateReq
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from dto.schemas import UrlAddReq, UrlBulkAddReq, UrlUpdateReq
 from utils.exceptions import ServiceError
 from utils.security import authorize_user
 
@@ -14,29 +18,70 @@ async def add(
     url_service = request.app.state.url_service
 
     try:
+        short_code: str = data.short_code or await url_service.generate_short_code()
         await url_service.create_short_url(
             user_id=user_id,
             original_url=str(data.original_url),
-            short_code=data.short_code,
+            short_code=short_code,
             password=data.password,
             valid_from=data.valid_from,
             valid_until=data.valid_until,
             expires_at=data.expires_at,
             allow_proxy=data.allow_proxy,
         )
-        return {"message": "Short URL created successfully"}
+        return {"message": "Short URL created successfully", "short_code": short_code}
     except ServiceError as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
 
 
+@router.post("/bulk")
+async def add_bulk(
+    data: UrlBulkAddReq, request: Request, user_id: int = Depends(authorize_user)
+):
+    url_service = request.app.state.url_service
+    results = await url_service.create_short_urls(
+        user_id,
+        [
+            {
+                "original_url": str(item.original_url),
+                "short_code": item.short_code
+                or await url_service.generate_short_code(),
+                "password": item.password,
+                "valid_from": item.valid_from,
+                "valid_until": item.valid_until,
+                "expires_at": item.expires_at,
+                "allow_proxy": item.allow_proxy,
+            }
+            for item in data.urls
+        ],
+    )
+    created: int = sum(1 for result in results if result["status"] == "created")
+    return {"created": created, "failed": len(results) - created, "results": results}
+
+
 @router.get("/")
 async def get_all_urls_by_user(
-    request: Request, user_id: int = Depends(authorize_user)
+    request: Request,
+    fields: Optional[List[str]] = Query(default=None),
+    after_id: Optional[int] = Query(default=None, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+    status: Optional[Literal["active", "expired"]] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    stream: bool = False,
+    user_id: int = Depends(authorize_user),
 ):
     url_service = request.app.state.url_service
 
     try:
-        return await url_service.fetch_user_urls(user_id)
+        if stream:
+            chunks = await url_service.stream_user_urls(
+                user_id, fields, status, created_from, created_to
+            )
+            return StreamingResponse(chunks, media_type="application/x-ndjson")
+        return await url_service.fetch_user_urls(
+            user_id, fields, after_id, limit, status, created_from, created_to
+        )
     except ServiceError as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
 
@@ -1,20 +1,46 @@
+from typing import Optional
+
 from config import gen_api_key, get_hash
 from repositories.apikey_repository import ApiKeyRepository
+from utils.cache import MISSING, LRUCache
 from utils.exceptions import ServiceError
 
 
 class ApiKeyService:
-    def __init__(self, apikey_repo: ApiKeyRepository):
+    def __init__(
+        self,
+        apikey_repo: ApiKeyRepository,
+        cache_size: int = 10000,
+        cache_ttl: float = 5.0,
+        negative_cache_size: int = 1000,
+        negative_cache_ttl: float = 10.0,
+    ):
         self.apikey_repo: ApiKeyRepository = apikey_repo
+        # Rotation only clears this worker's cache; other workers keep honouring
+        # the old key for up to cache_ttl seconds, so keep it short.
+        self.key_cache: LRUCache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.negative_cache: LRUCache = LRUCache(
+            maxsize=negative_cache_size, ttl=negative_cache_ttl
+        )
 
     async def generate_akey(self, user_id: int) -> str:
         key, hashed_key = gen_api_key()
-        await self.apikey_repo.upsert(user_id, hashed_key)
+        previous: Optional[str] = await self.apikey_repo.upsert(user_id, hashed_key)
+        self.negative_cache.invalidate(hashed_key)
+        if previous:
+            self.key_cache.invalidate(previous)
         return key
 
     async def validate_akey(self, key: str) -> int:
-        user_id = await self.apikey_repo.validate(get_hash(key))
-        if not user_id:
+        hashed_key: str = get_hash(key)
+        user_id: Optional[int] = self.key_cache.get(hashed_key)
+        if user_id is MISSING and self.negative_cache.get(hashed_key) is MISSING:
+            user_id = await self.apikey_repo.validate(hashed_key)
+            if user_id:
+                self.key_cache.set(hashed_key, user_id)
+            else:
+                self.negative_cache.set(hashed_key, True)
+        if user_id is MISSING or not user_id:
             raise ServiceError("Invalid or expired api-key", 401)
         return user_id
 
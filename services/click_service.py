@@ -1,37 +1,260 @@
-from datetime import datetime, timedelta
-from typing import Optional
+import asyncio
+import csv
+import io
+import json
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
 
 from user_agents import parse
 
 from repositories.click_repository import ClickRepository
+from utils.cache import MISSING, LRUCache
+from utils.exceptions import ServiceError
+from utils.hll import HyperLogLog
+from utils.metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS: List[str] = [
+    "id",
+    "short_code",
+    "clicked_at",
+    "browser",
+    "device",
+    "os",
+    "ip_address",
+    "country",
+    "region",
+    "city",
+    "provider",
+    "is_proxy",
+]
+
+TIMESERIES_STEPS: Dict[str, timedelta] = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+
+def parse_user_agent(
+    user_agent: str,
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    ua = parse(user_agent)
+
+    browser: Optional[str] = ua.browser.family or None
+    os: Optional[str] = ua.os.family or None
+    device: Optional[str] = None
+    if ua.is_mobile:
+        device = "phone"
+    elif ua.is_tablet:
+        device = "tablet"
+    elif ua.is_pc:
+        device = "computer"
+    elif ua.is_bot:
+        device = "bot"
+    return browser, os, device
+
+
+def build_rollups(
+    clicks: Iterable[tuple], ip_attributes: Dict[int, Tuple[Optional[str], bool]]
+) -> List[tuple]:
+    buckets: Dict[tuple, list] = {}
+    for url_id, clicked_at, browser, device, os, ip in clicks:
+        bucket: datetime = clicked_at.replace(minute=0, second=0, microsecond=0)
+        country, is_proxy = ip_attributes.get(ip, (None, False))
+        dimensions: List[tuple] = [
+            ("browser", browser),
+            ("os", os),
+            ("device", device),
+            ("country", country),
+            ("guests", None),
+        ]
+        if is_proxy:
+            dimensions.append(("proxy", None))
+        for dimension, value in dimensions:
+            entry: list = buckets.setdefault(
+                (url_id, bucket, dimension, value or ""), [0, HyperLogLog()]
+            )
+            entry[0] += 1
+            if ip is not None:
+                entry[1].add(ip)
+    return [
+        (*key, total, visitors.to_bytes())
+        for key, (total, visitors) in sorted(buckets.items(), key=lambda i: i[0])
+    ]
+
+
+def build_counters(clicks: Iterable[tuple]) -> List[Tuple[int, int, datetime]]:
+    counters: Dict[int, list] = {}
+    for url_id, clicked_at, *_ in clicks:
+        counter: Optional[list] = counters.get(url_id)
+        if counter is None:
+            counters[url_id] = [1, clicked_at]
+        else:
+            counter[0] += 1
+            counter[1] = max(counter[1], clicked_at)
+    return [(url_id, total, last) for url_id, (total, last) in sorted(counters.items())]
 
 
 class ClickService:
-    def __init__(self, click_repo: ClickRepository) -> None:
+    def __init__(
+        self,
+        click_repo: ClickRepository,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        enqueue_timeout: float = 0.0,
+        use_rollups: bool = True,
+        ua_cache_size: int = 4096,
+        ua_max_length: int = 512,
+        ua_parse_workers: int = 0,
+        max_timeseries_buckets: int = 1440,
+        export_settle: float = 60.0,
+    ) -> None:
         self.click_repo = click_repo
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.enqueue_timeout: float = enqueue_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.enqueued: int = 0
+        self.dropped: int = 0
+        self.flushed: int = 0
+        self.failed: int = 0
+        self._worker: Optional[asyncio.Task] = None
+        self.use_rollups: bool = use_rollups
+        self.ua_cache: LRUCache = LRUCache(maxsize=ua_cache_size, ttl=None)
+        self.ua_max_length: int = ua_max_length
+        self.ua_parse_workers: int = ua_parse_workers
+        self.export_settle: float = export_settle
+        self._ua_executor: Optional[Executor] = None
+        self.max_timeseries_buckets: int = max_timeseries_buckets
 
-    async def insert_click(self, url_id: int, user_agent: str, ip: int) -> None:
-        ua = parse(user_agent)
-
-        browser: Optional[str] = ua.browser.family or None
-        os: Optional[str] = ua.os.family or None
-        device: Optional[str] = None
-        if ua.is_mobile:
-            device = "phone"
-        elif ua.is_tablet:
-            device = "tablet"
-        elif ua.is_pc:
-            device = "computer"
-        elif ua.is_bot:
-            device = "bot"
-
-        await self.click_repo.add(
-            url_id=url_id,
-            ip=ip,
-            browser=browser,
-            os=os,
-            device=device,
-        )
+    async def start(self) -> None:
+        if self.ua_parse_workers > 0 and self._ua_executor is None:
+            self._ua_executor = ProcessPoolExecutor(max_workers=self.ua_parse_workers)
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            worker, self._worker = self._worker, None
+            await self.queue.put(None)
+            await worker
+        if self._ua_executor is not None:
+            self._ua_executor.shutdown(wait=True)
+            self._ua_executor = None
+
+    def queue_stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "maxsize": self.queue.maxsize,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "failed": self.failed,
+        }
+
+    async def parse_user_agent(
+        self, user_agent: Optional[str]
+    ) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        user_agent = user_agent or ""
+        cacheable: bool = len(user_agent) <= self.ua_max_length
+        if cacheable:
+            parsed = self.ua_cache.get(user_agent)
+            if parsed is not MISSING:
+                return parsed
+        if self._ua_executor is not None:
+            parsed = await asyncio.get_running_loop().run_in_executor(
+                self._ua_executor, parse_user_agent, user_agent
+            )
+        else:
+            parsed = parse_user_agent(user_agent)
+        if cacheable:
+            self.ua_cache.set(user_agent, parsed)
+        return parsed
+
+    async def insert_click(
+        self,
+        url_id: int,
+        user_agent: str,
+        ip: int,
+        clicked_at: Optional[datetime] = None,
+    ) -> None:
+        clicked_at = clicked_at or datetime.utcnow()
+        with STAGE_SECONDS.time("ua_parse"):
+            browser, os, device = await self.parse_user_agent(user_agent)
+
+        record: tuple = (url_id, clicked_at, browser, device, os, ip)
+        if self._worker is None:
+            await self._write_batch([record])
+            return
+
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            if self.enqueue_timeout <= 0:
+                self.dropped += 1
+                return
+            try:
+                await asyncio.wait_for(self.queue.put(record), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                return
+        self.enqueued += 1
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping: bool = False
+        while not stopping:
+            record = await self.queue.get()
+            if record is None:
+                break
+            batch: List[tuple] = [record]
+            deadline: float = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout: float = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+            await self._flush(batch)
+
+        batch = []
+        while not self.queue.empty():
+            record = self.queue.get_nowait()
+            if record is not None:
+                batch.append(record)
+            if len(batch) >= self.batch_size:
+                await self._flush(batch)
+                batch = []
+        if batch:
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[tuple]) -> None:
+        try:
+            await self._write_batch(batch)
+            self.flushed += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to flush %d clicks", len(batch))
+
+    async def _write_batch(self, batch: List[tuple]) -> None:
+        rollups: List[tuple] = []
+        if self.use_rollups:
+            ip_attributes = await self.click_repo.fetch_ip_attributes(
+                {record[5] for record in batch if record[5] is not None}
+            )
+            rollups = build_rollups(batch, ip_attributes)
+        await self.click_repo.add_many(batch, rollups, build_counters(batch))
 
     def _resolve_since(self, period: Optional[str]) -> Optional[datetime]:
         now = datetime.utcnow()
@@ -43,6 +266,26 @@ class ClickService:
             return now - timedelta(days=30)
         return None
 
+    def _rollup_breakdowns(self, rows: List[Any]) -> Dict[str, dict]:
+        breakdowns: Dict[str, dict] = {}
+        for row in rows:
+            breakdowns.setdefault(row["dimension"], {})[row["value"] or "unknown"] = {
+                "total": row["total"],
+                "unique": HyperLogLog.union(row["visitors"]).count(),
+            }
+        return breakdowns
+
+    def _rollup_guests(self, breakdowns: Dict[str, dict]) -> dict:
+        guests: dict = breakdowns.get("guests", {}).get(
+            "unknown", {"total": 0, "unique": 0}
+        )
+        proxies: dict = breakdowns.get("proxy", {}).get("unknown", {"unique": 0})
+        return {
+            "total": guests["total"],
+            "unique": guests["unique"],
+            "proxy": proxies["unique"],
+        }
+
     async def get_field_stats(
         self,
         url_id: int,
@@ -50,6 +293,9 @@ class ClickService:
         period: Optional[str],
     ) -> dict:
         since = self._resolve_since(period)
+        if self.use_rollups:
+            rows = await self.click_repo.get_rollup_stats(url_id, [field], since)
+            return self._rollup_breakdowns(rows).get(field, {})
         rows = await self.click_repo.get_field_stats(url_id, field, since)
         return {
             row[field] or "unknown": {"total": row["total"], "unique": row["unique"]}
@@ -58,6 +304,9 @@ class ClickService:
 
     async def get_countries_stats(self, url_id: int, period: Optional[str]) -> dict:
         since = self._resolve_since(period)
+        if self.use_rollups:
+            rows = await self.click_repo.get_rollup_stats(url_id, ["country"], since)
+            return self._rollup_breakdowns(rows).get("country", {})
         rows = await self.click_repo.get_countries_stats(url_id, since)
         return {
             row["country"]
@@ -67,5 +316,149 @@ class ClickService:
 
     async def get_guests_stats(self, url_id: int, period: Optional[str]) -> dict:
         since = self._resolve_since(period)
+        if self.use_rollups:
+            rows = await self.click_repo.get_rollup_stats(
+                url_id, ["guests", "proxy"], since
+            )
+            return self._rollup_guests(self._rollup_breakdowns(rows))
         row = await self.click_repo.get_guests_stats(url_id, since)
         return dict(row) if row else {}
+
+    async def get_summary_stats(self, url_id: int, period: Optional[str]) -> dict:
+        since = self._resolve_since(period)
+        if self.use_rollups:
+            rows = await self.click_repo.get_rollup_stats(
+                url_id, ["browser", "os", "device", "country", "guests", "proxy"], since
+            )
+            breakdowns: Dict[str, dict] = self._rollup_breakdowns(rows)
+            return {
+                "browsers": breakdowns.get("browser", {}),
+                "os": breakdowns.get("os", {}),
+                "devices": breakdowns.get("device", {}),
+                "countries": breakdowns.get("country", {}),
+                "guests": self._rollup_guests(breakdowns),
+            }
+
+        summary: dict = {
+            "browsers": {},
+            "os": {},
+            "devices": {},
+            "countries": {},
+            "guests": {"total": 0, "unique": 0, "proxy": 0},
+        }
+        for row in await self.click_repo.get_summary_stats(url_id, since):
+            if row["grouping_set"] == "guests":
+                summary["guests"] = {
+                    "total": row["total"],
+                    "unique": row["unique"],
+                    "proxy": row["proxy"],
+                }
+                continue
+            summary[row["grouping_set"]][row["value"] or "unknown"] = {
+                "total": row["total"],
+                "unique": row["unique"],
+            }
+        return summary
+
+    async def get_timeseries(
+        self,
+        url_id: int,
+        start: datetime,
+        end: Optional[datetime],
+        bucket: str,
+    ) -> List[dict]:
+        step: Optional[timedelta] = TIMESERIES_STEPS.get(bucket)
+        if step is None:
+            raise ServiceError(f"Unknown bucket: {bucket}", 422)
+        start = self._truncate(self._as_utc(start), bucket)
+        end = self._as_utc(end) if end else datetime.utcnow()
+        aligned_end: datetime = self._truncate(end, bucket)
+        end = aligned_end if aligned_end == end else aligned_end + step
+        if start >= end:
+            raise ServiceError("'from' must be earlier than 'to'", 422)
+        if (end - start) / step > self.max_timeseries_buckets:
+            raise ServiceError(
+                f"Range exceeds {self.max_timeseries_buckets} {bucket} buckets", 422
+            )
+
+        if self.use_rollups and bucket != "minute":
+            rows = await self.click_repo.get_rollup_timeseries(
+                url_id, bucket, start, end
+            )
+            counts: Dict[datetime, Tuple[int, int]] = {
+                row["bucket"]: (
+                    row["total"],
+                    HyperLogLog.union(row["visitors"]).count(),
+                )
+                for row in rows
+            }
+        else:
+            rows = await self.click_repo.get_click_timeseries(
+                url_id, bucket, start, end
+            )
+            counts = {row["bucket"]: (row["total"], row["unique"]) for row in rows}
+
+        series: List[dict] = []
+        moment: datetime = start
+        while moment < end:
+            total, unique = counts.get(moment, (0, 0))
+            series.append({"bucket": moment, "total": total, "unique": unique})
+            moment += step
+        return series
+
+    def _as_utc(self, moment: datetime) -> datetime:
+        if moment.tzinfo is not None:
+            return moment.astimezone(timezone.utc).replace(tzinfo=None)
+        return moment
+
+    def _truncate(self, moment: datetime, bucket: str) -> datetime:
+        moment = moment.replace(second=0, microsecond=0)
+        if bucket in ("hour", "day"):
+            moment = moment.replace(minute=0)
+        if bucket == "day":
+            moment = moment.replace(hour=0)
+        return moment
+
+    async def export_clicks(
+        self,
+        user_id: int,
+        url_id: Optional[int],
+        fmt: str,
+        after_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        chunk_rows: int = 500,
+    ) -> AsyncIterator[str]:
+        if since is not None:
+            since = self._as_utc(since)
+        until: datetime = datetime.utcnow() - timedelta(seconds=self.export_settle)
+        buffer: io.StringIO = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == "csv":
+            writer.writerow(EXPORT_COLUMNS)
+
+        pending: int = 0
+        async for row in self.click_repo.iter_export(
+            user_id, url_id, since, after_id, until, limit
+        ):
+            if fmt == "csv":
+                writer.writerow(
+                    [
+                        row[column].isoformat()
+                        if column == "clicked_at"
+                        else row[column]
+                        for column in EXPORT_COLUMNS
+                    ]
+                )
+            else:
+                buffer.write(json.dumps(dict(row), default=str))
+                buffer.write("\n")
+            pending += 1
+            if pending >= chunk_rows:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+
+        if buffer.tell():
+            yield buffer.getvalue()
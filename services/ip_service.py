@@ -1,62 +1,294 @@
+import asyncio
+import logging
 from ipaddress import IPv4Address, IPv6Address
-from typing import Optional
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
 
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
 
 from repositories.ip_repository import IpRepository
+from utils.cache import MISSING, LRUCache
+from utils.exceptions import ServiceError
+from utils.metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class IpRecord:
+    __slots__ = ("id", "is_proxy", "country")
+
+    def __init__(self, id: int, is_proxy: bool, country: Optional[str]) -> None:
+        self.id: int = id
+        self.is_proxy: bool = is_proxy
+        self.country: Optional[str] = country
+
+
+def ip_cache_key(ip_address: IPv4Address | IPv6Address) -> int | bytes:
+    if ip_address.version == 4:
+        return int(ip_address)
+    return ip_address.packed
 
 
 class IpService:
-    def __init__(self, ip_repo: IpRepository) -> None:
+    def __init__(
+        self,
+        ip_repo: IpRepository,
+        api_url: str = "https://proxycheck.io/v3/",
+        async_enrichment: bool = False,
+        lookup_timeout: float = 2.0,
+        fail_open: bool = False,
+        max_concurrent_lookups: int = 16,
+        max_pending_enrichments: int = 10000,
+        request_timeout: float = 5.0,
+        connection_limit: int = 32,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+        batch_window: float = 0.05,
+        batch_size: int = 100,
+        cache_size: int = 100000,
+    ) -> None:
         self.ip_repo: IpRepository = ip_repo
+        self.api_url: str = api_url
+        self.async_enrichment: bool = async_enrichment
+        self.lookup_timeout: float = lookup_timeout
+        self.fail_open: bool = fail_open
+        self.max_pending_enrichments: int = max_pending_enrichments
+        self._lookup_limit: asyncio.Semaphore = asyncio.Semaphore(
+            max_concurrent_lookups
+        )
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.request_timeout: float = request_timeout
+        self.connection_limit: int = connection_limit
+        self.keepalive_timeout: float = keepalive_timeout
+        self.dns_cache_ttl: int = dns_cache_ttl
+        self._session: Optional[ClientSession] = None
+        self.upstream_requests: int = 0
+        self.upstream_errors: int = 0
+        self.upstream_latency_total: float = 0.0
+        self.upstream_latency_max: float = 0.0
+        self.batch_window: float = batch_window
+        self.batch_size: int = batch_size
+        self._pending: Dict[str, IPv4Address | IPv6Address] = {}
+        self._batch_full: asyncio.Event = asyncio.Event()
+        self._batch_task: Optional[asyncio.Task] = None
+        self.ip_cache: LRUCache = LRUCache(maxsize=cache_size, ttl=None)
+
+    async def start(self) -> None:
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(
+                    limit=self.connection_limit,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                ),
+                timeout=ClientTimeout(total=self.request_timeout),
+            )
+
+    async def stop(self) -> None:
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self._batch_task is not None:
+            self._batch_full.set()
+            await asyncio.gather(self._batch_task, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def upstream_stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.upstream_requests,
+            "errors": self.upstream_errors,
+            "inflight": len(self._inflight),
+            "latency_avg": (
+                self.upstream_latency_total / self.upstream_requests
+                if self.upstream_requests
+                else 0.0
+            ),
+            "latency_max": self.upstream_latency_max,
+        }
 
     async def ensure_ip(self, ip_address: IPv4Address | IPv6Address) -> None:
-        if await self.ip_repo.exists_by_address(ip_address):
+        if self.cached_ip(ip_address) is not None:
             return
+        key: str = str(ip_address)
+        future: Optional[asyncio.Future] = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            self._pending[key] = ip_address
+            if len(self._pending) >= self.batch_size:
+                self._batch_full.set()
+            if self._batch_task is None:
+                self._batch_task = asyncio.create_task(self._run_batch())
+        await asyncio.shield(future)
+
+    async def get_ip_id(self, ip_address: IPv4Address | IPv6Address) -> Optional[int]:
+        record: Optional[IpRecord] = await self.get_ip(ip_address)
+        return record.id if record else None
 
-        data: dict = await self._fetch_ip_data(str(ip_address))
-
-        await self.ip_repo.add(
-            ip_address=ip_address,
-            longitude=data["longitude"],
-            latitude=data["latitude"],
-            is_proxy=data["is_proxy"],
-            timezone=data["timezone"],
-            provider=data["provider"],
-            country=data["country"],
-            region=data["region"],
-            city=data["city"],
+    def cached_ip(self, ip_address: IPv4Address | IPv6Address) -> Optional[IpRecord]:
+        record: Optional[IpRecord] = self.ip_cache.get(ip_cache_key(ip_address))
+        return None if record is MISSING else record
+
+    def remember_ip(
+        self, ip_address: IPv4Address | IPv6Address, row: dict
+    ) -> IpRecord:
+        record: IpRecord = IpRecord(row["id"], row["is_proxy"], row["country"])
+        self.ip_cache.set(ip_cache_key(ip_address), record)
+        return record
+
+    async def get_ip(
+        self, ip_address: IPv4Address | IPv6Address
+    ) -> Optional[IpRecord]:
+        record: Optional[IpRecord] = self.cached_ip(ip_address)
+        if record is not None:
+            return record
+        row: Optional[dict] = await self.ip_repo.fetchrow_by_ip(
+            ip_address, fields=["id", "is_proxy", "country"]
         )
+        return self.remember_ip(ip_address, row) if row else None
 
-    async def is_proxy(self, ip_address: IPv4Address | IPv6Address) -> bool:
-        await self.ensure_ip(ip_address)
-        row = await self.ip_repo.fetchrow_by_ip(ip_address, fields=["is_proxy"])
-        return row["is_proxy"]
+    async def lookup_ip(
+        self, ip_address: IPv4Address | IPv6Address, fail_open: Optional[bool] = None
+    ) -> Optional[IpRecord]:
+        try:
+            await asyncio.wait_for(self.ensure_ip(ip_address), self.lookup_timeout)
+        except Exception:
+            if self.fail_open if fail_open is None else fail_open:
+                return None
+            raise ServiceError("Unable to verify client IP address", 503)
+        return await self.get_ip(ip_address)
 
-    async def get_ip_id(self, ip_address: IPv4Address | IPv6Address) -> Optional[int]:
-        row = await self.ip_repo.fetchrow_by_ip(ip_address, fields=["id"])
-        return row["id"] if row else None
+    def enrich_later(
+        self,
+        ip_address: IPv4Address | IPv6Address,
+        on_resolved: Callable[[Optional[int]], Awaitable[None]],
+    ) -> bool:
+        if len(self._background) >= self.max_pending_enrichments:
+            return False
+        task: asyncio.Task = asyncio.create_task(self._enrich(ip_address, on_resolved))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return True
+
+    async def _enrich(
+        self,
+        ip_address: IPv4Address | IPv6Address,
+        on_resolved: Callable[[Optional[int]], Awaitable[None]],
+    ) -> None:
+        ip_id: Optional[int] = None
+        try:
+            await self.ensure_ip(ip_address)
+            ip_id = await self.get_ip_id(ip_address)
+        except Exception:
+            logger.exception("Failed to enrich IP address %s", ip_address)
+        await on_resolved(ip_id)
+
+    async def _run_batch(self) -> None:
+        try:
+            await asyncio.wait_for(self._batch_full.wait(), self.batch_window)
+        except asyncio.TimeoutError:
+            pass
+        self._batch_full.clear()
+        pending, self._pending = self._pending, {}
+        self._batch_task = None
+
+        keys: List[str] = list(pending)
+        for i in range(0, len(keys), self.batch_size):
+            await self._resolve_batch(
+                {key: pending[key] for key in keys[i : i + self.batch_size]}
+            )
 
-    async def _fetch_ip_data(self, ip: str) -> dict:
-        async with ClientSession() as session:
-            async with session.get(f"https://proxycheck.io/v3/{ip}") as resp:
+    async def _resolve_batch(
+        self, batch: Dict[str, IPv4Address | IPv6Address]
+    ) -> None:
+        resolved: Dict[str, dict] = {}
+        error: Optional[BaseException] = None
+        try:
+            known: Set[str] = await self.ip_repo.fetch_existing_addresses(
+                list(batch.values())
+            )
+            missing: List[str] = [key for key in batch if key not in known]
+            if missing:
+                async with self._lookup_limit:
+                    resolved = await self._fetch_ips_data(missing)
+                await self.ip_repo.add_many(
+                    [
+                        (
+                            batch[key],
+                            data["longitude"],
+                            data["latitude"],
+                            data["is_proxy"],
+                            data["timezone"],
+                            data["provider"],
+                            data["country"],
+                            data["region"],
+                            data["city"],
+                        )
+                        for key, data in resolved.items()
+                    ]
+                )
+            resolved.update((key, {}) for key in known)
+        except Exception as e:
+            logger.exception("Failed to resolve %d IP addresses", len(batch))
+            error = e
+
+        for key in batch:
+            future: Optional[asyncio.Future] = self._inflight.pop(key, None)
+            if future is None or future.done():
+                continue
+            if error is None and key in resolved:
+                future.set_result(None)
+                continue
+            future.set_exception(error or KeyError(key))
+            future.exception()
+
+    async def _fetch_ips_data(self, ips: List[str]) -> Dict[str, dict]:
+        await self.start()
+        started: float = perf_counter()
+        try:
+            async with self._session.post(
+                self.api_url, data={"ips": ",".join(ips)}
+            ) as resp:
                 ip_json: dict = await resp.json()
-                ip_data = ip_json[ip]
-
-                try:
-                    latitude = float(ip_data["location"]["latitude"])
-                    longitude = float(ip_data["location"]["longitude"])
-                except ValueError:
-                    latitude = longitude = None
-
-                return {
-                    "longitude": longitude,
-                    "latitude": latitude,
-                    "is_proxy": ip_data["detections"]["proxy"]
-                    or ip_data["detections"]["hosting"],
-                    "timezone": ip_data["location"]["timezone"],
-                    "provider": ip_data["network"]["provider"],
-                    "country": ip_data["location"]["country_name"],
-                    "region": ip_data["location"]["region_name"],
-                    "city": ip_data["location"]["city_name"],
-                }
+        except (asyncio.TimeoutError, ClientError):
+            self.upstream_errors += 1
+            raise
+        finally:
+            elapsed: float = perf_counter() - started
+            STAGE_SECONDS.observe("proxycheck", elapsed)
+            self.upstream_requests += 1
+            self.upstream_latency_total += elapsed
+            self.upstream_latency_max = max(self.upstream_latency_max, elapsed)
+
+        result: Dict[str, dict] = {}
+        for ip in ips:
+            ip_data: Optional[dict] = ip_json.get(ip)
+            if not isinstance(ip_data, dict):
+                continue
+            try:
+                result[ip] = self._parse_ip_data(ip_data)
+            except (KeyError, TypeError):
+                logger.warning("Malformed proxycheck data for %s", ip)
+        return result
+
+    @staticmethod
+    def _parse_ip_data(ip_data: dict) -> dict:
+        try:
+            latitude = float(ip_data["location"]["latitude"])
+            longitude = float(ip_data["location"]["longitude"])
+        except ValueError:
+            latitude = longitude = None
+
+        return {
+            "longitude": longitude,
+            "latitude": latitude,
+            "is_proxy": ip_data["detections"]["proxy"]
+            or ip_data["detections"]["hosting"],
+            "timezone": ip_data["location"]["timezone"],
+            "provider": ip_data["network"]["provider"],
+            "country": ip_data["location"]["country_name"],
+            "region": ip_data["location"]["region_name"],
+            "city": ip_data["location"]["city_name"],
+        }
@@ -3,9 +3,11 @@ from ipaddress import IPv4Address, IPv6Address
 from typing import Optional
 
 from services.click_service import ClickService
-from services.ip_service import IpService
+from services.ip_service import IpRecord, IpService
 from services.url_service import URLService
+from utils.cache import MISSING
 from utils.exceptions import ServiceError
+from utils.metrics import STAGE_SECONDS
 
 
 class RedirectService:
@@ -26,29 +28,51 @@ class RedirectService:
         ip_address: IPv4Address | IPv6Address,
         user_agent: str,
     ) -> str:
-        is_proxy = None
-        ip_id = None
+        with STAGE_SECONDS.time("total"):
+            return await self._resolve_redirect(
+                short_code, password, ip_address, user_agent
+            )
+
+    async def _resolve_redirect(
+        self,
+        short_code: str,
+        password: Optional[str],
+        ip_address: IPv4Address | IPv6Address,
+        user_agent: str,
+    ) -> str:
+        visitor_ip: Optional[IPv4Address | IPv6Address] = None
+        ip_record: Optional[IpRecord] = None
         if not ip_address.is_loopback:
-            is_proxy = await self.ip_service.is_proxy(ip_address)
-            ip_id = await self.ip_service.get_ip_id(ip_address)
-
-        row = await self.url_service.url_repo.fetchrow_by_shortcode(
-            short_code,
-            fields=[
-                "id",
-                "original_url",
-                "valid_from",
-                "valid_until",
-                "password",
-                "expires_at",
-                "allow_proxy",
-            ],
-        )
+            ip_record = self.ip_service.cached_ip(ip_address)
+            if ip_record is None:
+                visitor_ip = ip_address
+
+        with STAGE_SECONDS.time("url_lookup"):
+            row, ip_row = await self.url_service.fetch_redirect_row_with_ip(
+                short_code, visitor_ip
+            )
 
         if not row:
             raise ServiceError("Short code not found", 404)
 
-        if is_proxy and not row["allow_proxy"]:
+        deferred: bool = False
+        if visitor_ip is not None:
+            if ip_row is MISSING:
+                with STAGE_SECONDS.time("ip_lookup"):
+                    ip_record = await self.ip_service.get_ip(visitor_ip)
+            elif ip_row is not None:
+                ip_record = self.ip_service.remember_ip(visitor_ip, ip_row)
+            if ip_record is None:
+                if self.ip_service.async_enrichment and row["allow_proxy"]:
+                    deferred = True
+                else:
+                    with STAGE_SECONDS.time("ip_enrich"):
+                        ip_record = await self.ip_service.lookup_ip(
+                            visitor_ip,
+                            fail_open=self.ip_service.fail_open or row["allow_proxy"],
+                        )
+
+        if ip_record and ip_record.is_proxy and not row["allow_proxy"]:
             raise ServiceError("Access denied: proxy detected", 403)
 
         now = datetime.utcnow()
@@ -69,6 +93,18 @@ class RedirectService:
         if row["valid_until"] and now_time > row["valid_until"]:
             raise ServiceError("Access time window closed", 403)
 
-        await self.click_service.insert_click(row["id"], user_agent, ip_id)
+        if deferred:
+
+            async def insert_enriched_click(ip_id: Optional[int]) -> None:
+                await self.click_service.insert_click(
+                    row["id"], user_agent, ip_id, clicked_at=now
+                )
+
+            if self.ip_service.enrich_later(ip_address, insert_enriched_click):
+                return row["original_url"]
+
+        ip_id: Optional[int] = ip_record.id if ip_record else None
+        with STAGE_SECONDS.time("click_insert"):
+            await self.click_service.insert_click(row["id"], user_agent, ip_id)
 
         return row["original_url"]
@@ -1,4 +1,5 @@
-from typing import Optional
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
 
 from services.click_service import ClickService
 from services.url_service import URLService
@@ -12,7 +13,7 @@ class StatisticService:
 
     async def _resolve_url_id(self, user_id: int, short_code: str) -> int:
         row = await self.url_service.url_repo.fetchrow_by_shortcode(
-            short_code, fields=["id", "user_id"]
+            short_code, fields=["id", "user_id"], replica=True
         )
         if row is None:
             raise ServiceError("Short code not found", status_code=404)
@@ -52,3 +53,38 @@ class StatisticService:
     ) -> dict:
         url_id = await self._resolve_url_id(user_id, short_code)
         return await self.click_service.get_guests_stats(url_id, period)
+
+    async def get_summary_stats(
+        self, user_id: int, short_code: str, period: Optional[str] = None
+    ) -> dict:
+        url_id = await self._resolve_url_id(user_id, short_code)
+        return await self.click_service.get_summary_stats(url_id, period)
+
+    async def get_timeseries(
+        self,
+        user_id: int,
+        short_code: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        bucket: str = "hour",
+    ) -> List[dict]:
+        url_id = await self._resolve_url_id(user_id, short_code)
+        return await self.click_service.get_timeseries(url_id, start, end, bucket)
+
+    async def export_clicks(
+        self,
+        user_id: int,
+        short_code: Optional[str],
+        fmt: str,
+        after_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        if after_id is not None and since is None:
+            raise ServiceError("'after_id' requires 'since'", status_code=422)
+        url_id: Optional[int] = None
+        if short_code is not None:
+            url_id = await self._resolve_url_id(user_id, short_code)
+        return self.click_service.export_clicks(
+            user_id, url_id, fmt, after_id, since, limit
+        )
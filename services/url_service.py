@@ -1,14 +1,86 @@
+import asyncio
+import json
 from datetime import datetime, time, timedelta, timezone
-from typing import Any, Dict, List, Optional
+from ipaddress import IPv4Address, IPv6Address
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from asyncpg import UniqueViolationError
 
 from config import EDITABLE_URL_FIELDS as allowed_keys
 from repositories.url_repository import URLRepository
+from utils.cache import MISSING, LRUCache
 from utils.exceptions import ServiceError
+from utils.shortcode import encode_short_code
+
+REDIRECT_FIELDS: List[str] = [
+    "id",
+    "original_url",
+    "valid_from",
+    "valid_until",
+    "password",
+    "expires_at",
+    "allow_proxy",
+]
+
+NULLABLE_URL_FIELDS: List[str] = ["password", "valid_from", "valid_until"]
+
+LISTING_FIELDS: List[str] = [
+    "original_url",
+    "short_code",
+    "password",
+    "created_at",
+    "expires_at",
+    "valid_from",
+    "valid_until",
+    "allow_proxy",
+    "click_count",
+    "last_clicked_at",
+]
 
 
 class URLService:
-    def __init__(self, url_repo: URLRepository) -> None:
+    def __init__(
+        self,
+        url_repo: URLRepository,
+        cache_size: int = 10000,
+        cache_ttl: float = 60.0,
+        negative_cache_ttl: float = 5.0,
+        page_size: int = 100,
+    ) -> None:
         self.url_repo: URLRepository = url_repo
+        self.redirect_cache: LRUCache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.negative_cache_ttl: float = negative_cache_ttl
+        self.page_size: int = page_size
+        self._code_next: int = 0
+        self._code_end: int = 0
+        self._code_lock: asyncio.Lock = asyncio.Lock()
+
+    async def generate_short_code(self) -> str:
+        if self._code_next >= self._code_end:
+            async with self._code_lock:
+                if self._code_next >= self._code_end:
+                    self._code_next, self._code_end = (
+                        await self.url_repo.allocate_code_block()
+                    )
+        value: int = self._code_next
+        self._code_next += 1
+        return encode_short_code(value)
+
+    async def fetch_redirect_row_with_ip(
+        self,
+        short_code: str,
+        ip_address: Optional[IPv4Address | IPv6Address],
+    ) -> Tuple[Optional[dict], Any]:
+        row: Optional[dict] = self.redirect_cache.get(short_code)
+        if row is not MISSING:
+            return row, MISSING
+        row, ip_row = await self.url_repo.fetchrow_with_ip(
+            short_code, ip_address, fields=REDIRECT_FIELDS
+        )
+        self.redirect_cache.set(
+            short_code, row, ttl=None if row else self.negative_cache_ttl
+        )
+        return row, ip_row
 
     async def create_short_url(
         self,
@@ -21,13 +93,85 @@ class URLService:
         expires_at: Optional[datetime],
         allow_proxy: bool,
     ) -> int:
-        if await self.url_repo.shortcode_exists(short_code):
-            raise ServiceError(message="Short code already in use", status_code=409)
-        if await self.url_repo.exists_by_user_and_url(user_id, original_url):
+        expires_at = self._check_schedule(expires_at, valid_from, valid_until)
+
+        url_id: Optional[int] = await self.url_repo.add(
+            user_id,
+            original_url,
+            short_code,
+            password,
+            valid_from,
+            valid_until,
+            expires_at,
+            allow_proxy,
+        )
+        if url_id is None:
+            if await self.url_repo.shortcode_exists(short_code):
+                raise ServiceError(message="Short code already in use", status_code=409)
             raise ServiceError(
                 message="URL already added by this user", status_code=409
             )
+        self.redirect_cache.invalidate(short_code)
+        return url_id
 
+    async def create_short_urls(self, user_id: int, items: List[dict]) -> List[dict]:
+        results: List[dict] = [
+            {"short_code": item["short_code"], "status": "created"} for item in items
+        ]
+        seen_codes: set = set()
+        seen_urls: set = set()
+        rows: List[tuple] = []
+        for result, item in zip(results, items):
+            try:
+                if item["short_code"] in seen_codes:
+                    raise ServiceError("Duplicate short code in request", 409)
+                if item["original_url"] in seen_urls:
+                    raise ServiceError("Duplicate URL in request", 409)
+                expires_at = self._check_schedule(
+                    item["expires_at"], item["valid_from"], item["valid_until"]
+                )
+            except ServiceError as e:
+                result.update(
+                    status="error", detail=e.message, status_code=e.status_code
+                )
+                continue
+            seen_codes.add(item["short_code"])
+            seen_urls.add(item["original_url"])
+            rows.append(
+                (
+                    item["original_url"],
+                    item["short_code"],
+                    item["password"],
+                    item["valid_from"],
+                    item["valid_until"],
+                    expires_at,
+                    item["allow_proxy"],
+                )
+            )
+
+        taken_codes, taken_urls, inserted = await self.url_repo.add_many(user_id, rows)
+        self.redirect_cache.invalidate(*inserted)
+
+        urls_by_code: Dict[str, str] = {row[1]: row[0] for row in rows}
+        for result in results:
+            short_code: str = result["short_code"]
+            if result["status"] != "created" or short_code in inserted:
+                continue
+            if short_code in taken_codes:
+                message = "Short code already in use"
+            elif urls_by_code[short_code] in taken_urls:
+                message = "URL already added by this user"
+            else:
+                message = "Short code or URL already in use"
+            result.update(status="error", detail=message, status_code=409)
+        return results
+
+    def _check_schedule(
+        self,
+        expires_at: Optional[datetime],
+        valid_from: Optional[time],
+        valid_until: Optional[time],
+    ) -> Optional[datetime]:
         if expires_at:
             now = datetime.utcnow().replace(tzinfo=None)
             if expires_at.tzinfo is not None:
@@ -45,17 +189,7 @@ class URLService:
             raise ServiceError(
                 message="valid_from must be earlier than valid_until", status_code=422
             )
-
-        return await self.url_repo.add(
-            user_id,
-            original_url,
-            short_code,
-            password,
-            valid_from,
-            valid_until,
-            expires_at,
-            allow_proxy,
-        )
+        return expires_at
 
     async def update_short_url(
         self,
@@ -66,57 +200,101 @@ class URLService:
         fields: Dict[str, Any] = {
             key: value for key, value in fields.items() if key in allowed_keys
         }
-        row: Optional[dict] = await self.url_repo.fetchrow_by_shortcode(
-            short_code, fields=["user_id"]
-        )
-        if "expires_at" in fields:
-            now = datetime.utcnow().replace(tzinfo=None)
-            expires_at = fields["expires_at"]
-            if expires_at.tzinfo is not None:
-                fields["expires_at"] = expires_at.replace(tzinfo=None)
-            if expires_at < now:
-                raise ServiceError(
-                    message="Expiration date cannot be in the past", status_code=422
-                )
-            if expires_at - now > timedelta(days=30):
-                raise ServiceError(
-                    message="URL lifetime cannot exceed 30 days", status_code=422
-                )
-        if row is None:
-            raise ServiceError(message="Short code not found", status_code=404)
-        if row["user_id"] != user_id:
+        for key, value in fields.items():
+            if value is None and key not in NULLABLE_URL_FIELDS:
+                raise ServiceError(message=f"'{key}' cannot be null", status_code=422)
+        if fields.get("original_url") is not None:
+            fields["original_url"] = str(fields["original_url"])
+        if fields.get("expires_at") is not None:
+            fields["expires_at"] = self._check_schedule(
+                fields["expires_at"], None, None
+            )
+        self._check_schedule(None, fields.get("valid_from"), fields.get("valid_until"))
+
+        try:
+            updated: bool = await self.url_repo.update_by_shortcode(
+                short_code, user_id, fields
+            )
+        except UniqueViolationError as e:
+            if e.constraint_name == "urls_short_code_key":
+                raise ServiceError(message="Short code already in use", status_code=409)
             raise ServiceError(
-                message="You do not have permission to edit this URL", status_code=403
+                message="URL already added by this user", status_code=409
             )
-        if fields.get(
-            "original_url"
-        ) is not None and await self.url_repo.exists_by_user_and_url(
-            user_id, str(fields["original_url"])
-        ):
-            raise ServiceError(message="URL already added by this user")
-        if (
-            fields.get("short_code") is not None
-            and fields["short_code"] != short_code
-            and await self.url_repo.shortcode_exists(fields["short_code"])
-        ):
-            raise ServiceError(message="Short code already in use", status_code=409)
-        if (
-            "valid_from" in fields
-            and "valid_until" in fields
-            and fields["valid_from"] >= fields["valid_until"]
-        ):
-            raise ServiceError("valid_from must be earlier than valid_until", 422)
 
-        await self.url_repo.update_by_shortcode(short_code, fields)
+        if not updated:
+            row: Optional[dict] = await self.url_repo.fetchrow_by_shortcode(
+                short_code, fields=["user_id"]
+            )
+            if row is None:
+                raise ServiceError(message="Short code not found", status_code=404)
+            raise ServiceError(
+                message="You do not have permission to edit this URL", status_code=403
+            )
+        self.redirect_cache.invalidate(short_code, fields.get("short_code"))
 
-    async def fetch_user_urls(self, user_id: int) -> List[dict]:
-        rows: List[dict] = await self.url_repo.fetch_by_user_id(user_id)
-        if not rows:
+    async def fetch_user_urls(
+        self,
+        user_id: int,
+        fields: Optional[List[str]] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        status: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+    ) -> dict | List[dict]:
+        fields = self._listing_fields(fields)
+        paged: bool = after_id is not None or limit is not None
+        if paged:
+            limit = limit or self.page_size
+        rows = await self.url_repo.fetch_by_user_id(
+            user_id, fields, after_id, limit, status, created_from, created_to
+        )
+        if not rows and after_id is None:
             raise ServiceError(message="User has no shortened URLs", status_code=404)
-        return [
-            {key: value for key, value in row.items() if key not in ("id", "user_id")}
-            for row in rows
-        ]
+        items: List[dict] = [{field: row[field] for field in fields} for row in rows]
+        if not paged:
+            return items
+        return {
+            "items": items,
+            "next_cursor": rows[-1]["id"] if len(rows) == limit else None,
+        }
+
+    async def stream_user_urls(
+        self,
+        user_id: int,
+        fields: Optional[List[str]] = None,
+        status: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+    ) -> AsyncIterator[str]:
+        return self._iter_user_urls(
+            user_id, self._listing_fields(fields), status, created_from, created_to
+        )
+
+    async def _iter_user_urls(
+        self,
+        user_id: int,
+        fields: List[str],
+        status: Optional[str],
+        created_from: Optional[datetime],
+        created_to: Optional[datetime],
+    ) -> AsyncIterator[str]:
+        async for row in self.url_repo.iter_by_user_id(
+            user_id, fields, status, created_from, created_to
+        ):
+            yield json.dumps({field: row[field] for field in fields}, default=str)
+            yield "\n"
+
+    def _listing_fields(self, fields: Optional[List[str]]) -> List[str]:
+        if not fields:
+            return LISTING_FIELDS
+        unknown: List[str] = [field for field in fields if field not in LISTING_FIELDS]
+        if unknown:
+            raise ServiceError(
+                message=f"Unknown fields: {', '.join(unknown)}", status_code=422
+            )
+        return list(dict.fromkeys(fields))
 
     async def fetch_by_shortcode(self, user_id: int, short_code: str) -> dict:
         row: Optional[dict] = await self.url_repo.fetchrow_by_shortcode(
@@ -130,6 +308,8 @@ class URLService:
                 "valid_from",
                 "valid_until",
                 "allow_proxy",
+                "click_count",
+                "last_clicked_at",
             ],
         )
         if row is None:
@@ -157,6 +337,9 @@ class URLService:
             )
 
         await self.url_repo.delete_by_shortcode(short_code)
+        self.redirect_cache.invalidate(short_code)
 
     async def delete_by_user(self, user_id: int) -> int:
-        return await self.url_repo.delete_by_user_id(user_id)
+        short_codes: List[str] = await self.url_repo.delete_by_user_id(user_id)
+        self.redirect_cache.invalidate(*short_codes)
+        return len(short_codes)
@@ -0,0 +1,25 @@
+from os import getenv
+from typing import Optional
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value: Optional[str] = getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in TRUE_VALUES
+
+
+def env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value: Optional[str] = getenv(name)
+    if value is None or not value.strip():
+        return default
+    return int(value)
+
+
+def env_float(name: str, default: float) -> float:
+    value: Optional[str] = getenv(name)
+    if value is None or not value.strip():
+        return default
+    return float(value)
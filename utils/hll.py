@@ -0,0 +1,85 @@
+from math import log
+from struct import pack, unpack_from
+from typing import Iterable, Optional, Set
+
+PRECISION: int = 10
+REGISTERS: int = 1 << PRECISION
+EXACT_LIMIT: int = 255
+_MASK32: int = (1 << 32) - 1
+_REST_BITS: int = 32 - PRECISION
+_ALPHA: float = 0.7213 / (1 + 1.079 / REGISTERS)
+_EXACT: int = 0
+_DENSE: int = 1
+
+
+def _hash32(value: int) -> int:
+    h = value & _MASK32
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & _MASK32
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & _MASK32
+    return h ^ (h >> 16)
+
+
+class HyperLogLog:
+    __slots__ = ("ids", "registers")
+
+    def __init__(self, data: Optional[bytes] = None) -> None:
+        self.ids: Optional[Set[int]] = set()
+        self.registers: Optional[bytearray] = None
+        self.merge(data)
+
+    def add(self, value: int) -> None:
+        if self.ids is None:
+            self._add_register(value)
+            return
+        self.ids.add(value)
+        if len(self.ids) > EXACT_LIMIT:
+            self._densify()
+
+    def _add_register(self, value: int) -> None:
+        h: int = _hash32(value)
+        index: int = h >> _REST_BITS
+        rank: int = _REST_BITS - (h & ((1 << _REST_BITS) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def _densify(self) -> None:
+        ids, self.ids = self.ids, None
+        self.registers = bytearray(REGISTERS)
+        for value in ids:
+            self._add_register(value)
+
+    def merge(self, data: Optional[bytes]) -> None:
+        if not data:
+            return
+        if data[0] == _EXACT:
+            for value in unpack_from(f">{(len(data) - 1) // 4}i", data, 1):
+                self.add(value)
+            return
+        if self.ids is not None:
+            self._densify()
+        self.registers = bytearray(map(max, self.registers, data[1:]))
+
+    def count(self) -> int:
+        if self.ids is not None:
+            return len(self.ids)
+        zeros: int = self.registers.count(0)
+        estimate: float = (
+            _ALPHA * REGISTERS * REGISTERS / sum(2.0**-r for r in self.registers)
+        )
+        if estimate <= 2.5 * REGISTERS and zeros:
+            estimate = REGISTERS * log(REGISTERS / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        if self.ids is not None:
+            return pack(f">B{len(self.ids)}i", _EXACT, *sorted(self.ids))
+        return bytes((_DENSE,)) + bytes(self.registers)
+
+    @classmethod
+    def union(cls, sketches: Iterable[Optional[bytes]]) -> "HyperLogLog":
+        hll = cls()
+        for data in sketches:
+            hll.merge(data)
+        return hll
@@ -0,0 +1,157 @@
+from bisect import bisect_left
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Timer:
+    __slots__ = ("histogram", "label", "started")
+
+    def __init__(self, histogram: "Histogram", label: str) -> None:
+        self.histogram: Histogram = histogram
+        self.label: str = label
+
+    def __enter__(self) -> "Timer":
+        self.started: float = perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.histogram.observe(self.label, perf_counter() - self.started)
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label: str,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.label: str = label
+        self.buckets: Tuple[float, ...] = buckets
+        self._series: Dict[str, list] = {}
+
+    def observe(self, label: str, value: float) -> None:
+        series: list = self._series.get(label)
+        if series is None:
+            series = self._series[label] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, label: str) -> Timer:
+        return Timer(self, label)
+
+    def render(self) -> List[str]:
+        lines: List[str] = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for label, (counts, total) in sorted(self._series.items()):
+            selector: str = f'{self.label}="{_escape(label)}"'
+            cumulative: int = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{selector},le="{_format_value(bound)}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(f"{self.name}_sum{{{selector}}} {_format_value(total)}")
+            lines.append(f"{self.name}_count{{{selector}}} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS: Histogram = Histogram(
+    "redirect_stage_seconds", "Time spent in each redirect stage.", "stage"
+)
+QUERY_SECONDS: Histogram = Histogram(
+    "db_query_seconds", "Time spent in each repository call.", "query"
+)
+
+
+def timed_queries(prefix: str) -> Callable[[type], type]:
+    def decorate(cls: type) -> type:
+        for name, method in list(vars(cls).items()):
+            if name.startswith("_") or not iscoroutinefunction(method):
+                continue
+            setattr(cls, name, _timed(f"{prefix}.{name}", method))
+        return cls
+
+    return decorate
+
+
+def _timed(query: str, method: Callable) -> Callable:
+    observe: Callable[[str, float], None] = QUERY_SECONDS.observe
+
+    @wraps(method)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started: float = perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            observe(query, perf_counter() - started)
+
+    return wrapper
+
+
+def render_gauges(
+    prefix: str,
+    label: str,
+    stats: Mapping[str, Mapping[str, Any]],
+    counters: Iterable[str] = (),
+) -> List[str]:
+    counters = set(counters)
+    families: Dict[str, List[str]] = {}
+    kinds: Dict[str, str] = {}
+    for label_value, values in stats.items():
+        for key, value in values.items():
+            if not isinstance(value, (int, float)):
+                continue
+            name: str = f"{prefix}_{key}"
+            if key in counters:
+                name += "_total"
+            kinds[name] = "counter" if key in counters else "gauge"
+            families.setdefault(name, []).append(
+                f'{name}{{{label}="{_escape(label_value)}"}} {_format_value(value)}'
+            )
+    lines: List[str] = []
+    for name, samples in families.items():
+        lines.append(f"# TYPE {name} {kinds[name]}")
+        lines.extend(samples)
+    return lines
+
+
+def render_metrics(histograms: Iterable[Histogram], gauges: Iterable[str]) -> str:
+    lines: List[str] = []
+    for histogram in histograms:
+        lines.extend(histogram.render())
+    lines.extend(gauges)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,19 @@
+from string import ascii_letters, digits
+
+ALPHABET: str = digits + ascii_letters
+GENERATED_PREFIX: str = "~"
+CODE_LENGTH: int = 8
+_SPACE: int = len(ALPHABET) ** CODE_LENGTH
+_MULTIPLIER: int = 150_320_117_939_041
+_OFFSET: int = 48_813_091_455_127
+
+
+def encode_short_code(value: int) -> str:
+    if not 0 <= value < _SPACE:
+        raise ValueError("Short code sequence exhausted")
+    value = (value * _MULTIPLIER + _OFFSET) % _SPACE
+    chars: list = []
+    for _ in range(CODE_LENGTH):
+        value, index = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[index])
+    return GENERATED_PREFIX + "".join(reversed(chars))